@@ -0,0 +1,140 @@
+import asyncio
+import struct
+from time import monotonic
+
+
+HEADER = b'\xFF\xFF\xFF\xFF'
+SPLIT = b'\xFF\xFF\xFF\xFE'
+A2S_INFO = HEADER + b'TSource Engine Query\x00'
+A2S_PLAYER = HEADER + b'U'
+NO_CHALLENGE = HEADER
+
+S2C_CHALLENGE = 0x41
+S2A_INFO = 0x49
+S2A_PLAYER = 0x44
+
+
+class Reader():
+    '''Read little endian fields from a response payload'''
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(f'<{fmt}', self.data, self.offset)
+        self.offset += struct.calcsize(f'<{fmt}')
+        return values[0] if len(values) == 1 else values
+
+    def string(self):
+        end = self.data.index(b'\x00', self.offset)
+        value = self.data[self.offset:end].decode(errors='replace')
+        self.offset = end + 1
+        return value
+
+
+def parse_info(data):
+    '''Return dict of an A2S_INFO response payload'''
+    r = Reader(data)
+    info = {'protocol': r.unpack('B'), 'name': r.string(), 'map': r.string(),
+            'folder': r.string(), 'game': r.string(), 'app_id': r.unpack('H')}
+    info['players'], info['max_players'], info['bots'] = r.unpack('BBB')
+    server_type, environment, visibility, vac = r.unpack('cccB')
+    info.update({'server_type': server_type.decode(), 'environment': environment.decode(),
+                 'password': visibility == b'\x01', 'vac': bool(vac)})
+    return info
+
+
+def parse_players(data):
+    '''Return list of dicts of an A2S_PLAYER response payload'''
+    r = Reader(data)
+    players = []
+    for _ in range(r.unpack('B')):
+        r.unpack('B')
+        name = r.string()
+        score, duration = r.unpack('lf')
+        players.append({'name': name, 'score': score, 'duration': duration})
+    return players
+
+
+class QueryProtocol(asyncio.DatagramProtocol):
+    '''Datagram protocol collecting responses, assembling split packets'''
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.splits = {}
+        self.sent = None
+
+    def datagram_received(self, data, addr):
+        if data.startswith(HEADER):
+            self.queue.put_nowait(data[4:])
+        elif data.startswith(SPLIT) and len(data) >= 12:
+            # source engine split packet: id, total, number and packet size
+            packet_id, total, number = struct.unpack_from('<lBB', data, 4)
+            packets = self.splits.setdefault(packet_id, {})
+            packets[number] = data[12:]
+            if len(packets) == total:
+                del self.splits[packet_id]
+                payload = b''.join(packets[i] for i in range(total))
+                if payload.startswith(HEADER):
+                    self.queue.put_nowait(payload[4:])
+
+    def error_received(self, exc):
+        self.queue.put_nowait(exc)
+
+    async def request(self, transport, data, expected, timeout):
+        '''Send data and return the expected response, answering challenges'''
+        for _ in range(3):
+            # the round trip time is of the last request, not the challenge
+            self.sent = monotonic()
+            transport.sendto(data)
+            response = await asyncio.wait_for(self.queue.get(), timeout)
+            if isinstance(response, Exception):
+                raise response
+
+            if response[0] == S2C_CHALLENGE and len(response) >= 5:
+                challenge = response[1:5]
+                if data.startswith(A2S_INFO):
+                    data = A2S_INFO + challenge
+                else:
+                    data = data[:5] + challenge
+            elif response[0] == expected:
+                return response[1:]
+        raise ConnectionError('No response after challenge')
+
+
+async def query(host, port, timeout=1, players=False):
+    '''Return A2S_INFO of a server with its round trip time in ms or None
+
+    With players the A2S_PLAYER list is added as player_list. A server that
+    does not answer within timeout seconds returns None.
+    '''
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.create_datagram_endpoint(
+            QueryProtocol, remote_addr=(host, int(port)))
+    except OSError:
+        return None
+
+    try:
+        info = parse_info(await protocol.request(transport, A2S_INFO, S2A_INFO, timeout))
+        info['rtt'] = (monotonic() - protocol.sent) * 1000
+
+        if players:
+            data = await protocol.request(transport, A2S_PLAYER + NO_CHALLENGE, S2A_PLAYER,
+                                          timeout)
+            info['player_list'] = parse_players(data)
+        return info
+    except (asyncio.TimeoutError, ConnectionError, OSError, struct.error, ValueError):
+        return None
+    finally:
+        transport.close()
+
+
+def query_all(addresses, timeout=1, players=False):
+    '''Query all host and port pairs concurrently, returning results in order'''
+    async def gather():
+        return await asyncio.gather(*(query(host, port, timeout, players)
+                                      for host, port in addresses))
+
+    if not addresses:
+        return []
+    return asyncio.run(gather())
@@ -1,17 +1,29 @@
 import os
 import platform
+import re
 import shutil
 import signal
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from pathlib import Path
+from queue import Queue
 from smtplib import SMTP
-from time import sleep
+from time import monotonic, sleep, time
 
 import click
 
+from . import logs as log
+from . import metrics, rcon
+from .a2s import query_all
 from .config import Config
 from .core import App, Index, Server, SteamCMD
+from .disk import IONICE_CLASSES, DiskUsage, human_size, set_priority
+from .hibernate import Waker
+from .s3 import S3Storage
+from .watchdog import Watchdog
 
 
 LOGIN_OPTIONS = [
@@ -21,6 +33,21 @@ LOGIN_OPTIONS = [
 ]
 
 
+JOB_OPTIONS = [
+    click.option('-j', '--jobs', type=int, default=Config.jobs, help='Number of parallel jobs'),
+]
+
+READY_OPTIONS = [
+    click.option('--wait', is_flag=True, help='Wait until the server is ready'),
+    click.option('-t', '--timeout', type=int, help='Ready timeout in seconds'),
+    click.option('-m', '--max-loading', type=int, default=Config.max_loading,
+                 help='Maximum number of servers loading at once'),
+]
+
+# per thread output buffer used to keep parallel job output in order
+_output = threading.local()
+
+
 def add_options(options):
     def wrapper(func):
         for option in reversed(options):
@@ -37,7 +64,7 @@ def main(ctx):
 
     if ctx.invoked_subcommand != 'setup':
         if not Config.config_f.exists():
-            click.echo('[ ------ ]')
+            echo('[ ------ ]')
             message('Error', 'No config file found')
             ctx.forward(setup)
         Index.update()
@@ -45,12 +72,12 @@ def main(ctx):
     if ctx.invoked_subcommand in ['console', 'kill', 'monitor', 'restart',
                                   'send', 'start', 'status', 'stop']:
         if platform.system() == 'Windows':
-            click.echo('[ ------ ]')
+            echo('[ ------ ]')
             message('Error', 'Not supported on Windows')
             sys.exit(1)
 
-        if not shutil.which('tmux'):
-            click.echo('[ ------ ]')
+        if Config.backend == 'tmux' and not shutil.which('tmux'):
+            echo('[ ------ ]')
             message('Error', 'Tmux is not installed')
             sys.exit(1)
 
@@ -60,7 +87,17 @@ def main(ctx):
 @click.option('-c', '--compression', default=Config.compression, help='Compression method')
 @click.option('-f', '--force', is_flag=True, help='Run command even if running')
 @click.option('-n', '--no-compress', is_flag=True, help='No compression')
-def backup(apps, compression, no_compress, force):
+@click.option('-r', '--rate-limit', type=float, default=Config.backup_rate_limit,
+              help='Read rate limit in MB/s')
+@click.option('--nice', type=int, default=Config.backup_nice, help='CPU nice increment')
+@click.option('--ionice', type=click.Choice([*IONICE_CLASSES]), default=Config.backup_ionice,
+              help='I/O scheduling class')
+@click.option('--drop-cache/--keep-cache', default=Config.backup_drop_cache,
+              help='Drop backed up files from the page cache')
+@click.option('-s', '--s3', is_flag=True, help='Stream backup to S3 storage')
+@add_options(JOB_OPTIONS)
+def backup(apps, compression, no_compress, force, rate_limit, nice, ionice, drop_cache, s3,
+           jobs):
     '''Backup app'''
 
     if compression and compression not in ['bz2', 'gz', 'xz']:
@@ -69,7 +106,21 @@ def backup(apps, compression, no_compress, force):
         if no_compress:
             compression = None
 
-        for app in app_special_names(apps):
+        storage = storage_wrapper() if s3 else None
+
+        # set before starting jobs so worker threads inherit it
+        try:
+            exit_code = set_priority(nice, ionice)
+        except OSError as e:
+            # lowering nice below 0 needs root
+            message('Error', f'Unable to set priority: {e.strerror}')
+            return
+        if exit_code != 0:
+            # the realtime I/O class needs root as well
+            message('Error', f'Unable to set I/O priority: {ionice}')
+            return
+
+        def job(app):
             a = app_wrapper(app)
             info(a.app_name, a.app_id)
 
@@ -77,12 +128,29 @@ def backup(apps, compression, no_compress, force):
                 message('Error', 'App not installed')
             elif not force and a.running:
                 message('Error', 'Stop server before backup')
+            elif storage:
+                message('Status', 'Backup started')
+                started = monotonic()
+                f = a.backup(compression, int(rate_limit * 1024 * 1024), drop_cache,
+                             storage=storage)
+                message('Status', 'Backup complete')
+                backup_metrics(a, monotonic() - started, storage.size(f'{a.backup_key}/{f.name}'))
+
+                backups = storage.list(a.backup_key)
+                keep = App.retention(backups, Config.max_backups, Config.retention_daily,
+                                     Config.retention_weekly, Config.retention_monthly)
+                for backup in backups:
+                    if backup not in keep:
+                        storage.delete(f'{a.backup_key}/{backup}')
+                return True
             else:
                 a.backup_dir.mkdir(parents=True, exist_ok=True)
-                backups = os.listdir(a.backup_dir)
+                backups = a.backups
                 length = len(backups)
+                tiered = any([Config.retention_daily, Config.retention_weekly,
+                              Config.retention_monthly])
 
-                if Config.max_backups != 0 and length >= Config.max_backups:
+                if not tiered and Config.max_backups != 0 and length >= Config.max_backups:
                     message('Status', 'Max backups reached')
                     message('Status', 'Removing old backups')
 
@@ -90,8 +158,20 @@ def backup(apps, compression, no_compress, force):
                         Path(a.backup_dir, backup).unlink()
 
                 message('Status', 'Backup started')
-                a.backup(compression)
+                started = monotonic()
+                f = a.backup(compression, int(rate_limit * 1024 * 1024), drop_cache)
                 message('Status', 'Backup complete')
+                backup_metrics(a, monotonic() - started, f.stat().st_size)
+
+                if tiered:
+                    removed = a.prune_backups(Config.max_backups, Config.retention_daily,
+                                              Config.retention_weekly, Config.retention_monthly)
+                    if removed:
+                        message('Status', f'Removed {len(removed)} old backups')
+                return True
+            return False
+
+        run_jobs(job, app_special_names(apps), jobs)
 
 
 @main.command()
@@ -183,10 +263,12 @@ def kill(apps):
 
 @main.command()
 @click.argument('apps', nargs=-1)
-def list(apps):
+@click.option('-s', '--size', is_flag=True, help='Show install, backup and reclaimable size')
+def list(apps, size):
     '''List installed or all installable apps'''
 
     arg = None
+    du = DiskUsage(Path(Config.state_dir, 'du.json')) if size else None
 
     if apps == ('all',):
         apps = Index.list_all()
@@ -196,7 +278,7 @@ def list(apps):
     for app in app_special_names(apps):
         a = app_wrapper(app)
 
-        click.echo('[ ------ ]')
+        echo('[ ------ ]')
         message('F-Name', a.full_name)
         message('Name', a.app_name)
         message('App ID', a.app_id)
@@ -206,6 +288,19 @@ def list(apps):
         else:
             message('Status', 'Not installed')
 
+        if du:
+            backups = a.backups
+            keep = App.retention(backups, Config.max_backups, Config.retention_daily,
+                                 Config.retention_weekly, Config.retention_monthly)
+            reclaim = sum(du.size(Path(a.backup_dir, b)) for b in backups if b not in keep)
+            # partial downloads left behind by steamcmd
+            for d in 'downloading', 'temp':
+                reclaim += du.size(Path(a.app_dir, 'steamapps', d))
+
+            message('Size', f'Install {human_size(du.size(a.app_dir))}')
+            message('Size', f'Backups {human_size(du.size(a.backup_dir))}')
+            message('Size', f'Reclaim {human_size(reclaim)}')
+
         if arg == 'backups':
             message('Status', f'Backups (Max {Config.max_backups})')
 
@@ -215,12 +310,77 @@ def list(apps):
             for i, backup in enumerate(backups):
                 message(i + 1, backup)
 
+    if du:
+        du.save()
+
+
+@main.command()
+@click.argument('apps', nargs=-1)
+@click.option('-f', '--follow', is_flag=True, help='Follow new output')
+@click.option('-g', '--grep', help='Only show lines matching a regex')
+@click.option('-n', '--lines', type=int, help='Number of lines to show')
+@click.option('-s', '--since', help='Show output since an age like 2h or a date')
+def logs(apps, follow, grep, lines, since):
+    '''Show server logs'''
+
+    try:
+        pattern = re.compile(grep.encode()) if grep else None
+        since = log.parse_since(since) if since else None
+    except (re.error, ValueError) as e:
+        echo('[ ------ ]')
+        message('Error', e)
+        sys.exit(1)
+
+    if lines is None and not since:
+        lines = 10
+
+    servers = [server_wrapper(app) for app in app_special_names(apps, server=True)]
+
+    def job(s):
+        if since:
+            return [*deque(log.read(s.log_dir, since, pattern), maxlen=lines)]
+        return log.tail(s.log_dir, lines, pattern)
+
+    # search the logs of all servers in parallel, printing them in order
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for s, found in zip(servers, executor.map(job, servers)):
+            info(s.server_name)
+            if not s.log_dir.exists():
+                message('Error', 'No logs')
+            for line in found:
+                click.echo(line.decode(errors='replace'))
+
+    if follow and servers:
+        echo('[ ------ ]')
+        follow_logs(servers, pattern)
+
+
+@main.command('metrics')
+@click.option('-l', '--listen', is_flag=True, help='Serve metrics over http')
+@click.option('-a', '--address', default=Config.metrics_listen, help='Listen address and port')
+@click.option('-t', '--textfile', default=Config.metrics_textfile,
+              help='Write metrics to a textfile collector file')
+def metrics_command(listen, address, textfile):
+    '''Export Prometheus metrics'''
+
+    if listen:
+        host, _, port = address.rpartition(':')
+        echo('[ ------ ]')
+        message('Status', f'Serving metrics on http://{address}/metrics')
+        metrics.serve(host or '127.0.0.1', int(port))
+    elif textfile:
+        metrics.write_textfile(textfile)
+    else:
+        click.echo(metrics.render(), nl=False)
+
 
 @main.command()
 @click.argument('apps', nargs=-1)
 @click.option('-e', '--email', is_flag=True, help='Email')
 @click.option('-r', '--restart', is_flag=True, help='Restart if stopped')
-def monitor(apps, email, restart):
+@click.option('-i', '--idle', type=int, default=Config.hibernate,
+              help='Hibernate servers without players for minutes')
+def monitor(apps, email, restart, idle):
     '''Monitor server status'''
 
     sessions = {}
@@ -233,23 +393,41 @@ def monitor(apps, email, restart):
             message('Error', 'No server entry')
         else:
             if s.server_name:
-                sessions[s.session_name] = {}
+                sessions[s.session_name] = s
             else:
                 for server_name in s.server_names:
-                    sessions[f'{s.app_name}-{server_name}'] = {}
+                    server = Server(s.app_name, Config.app_dir, server=server_name)
+                    sessions[server.session_name] = server
 
-    sessions = {session: {'running': False, 'restarts': 0, 'time': 0}
-                for session in sessions}
+    # servers are kept as names can not tell instances of an app apart
+    sessions = {session: {'server': s, 'running': False, 'restarts': 0, 'time': 0}
+                for session, s in sessions.items()}
+    hibernating, idle_since, queried = {}, {}, 0
+    watchdogs, watched = {}, 0
 
     while sessions:
+        running = Server.running_sessions()
+
+        if monotonic() - watched >= 5:
+            watched = monotonic()
+            watch_servers(sessions, running, watchdogs)
+
+        if idle and monotonic() - queried >= 15:
+            queried = monotonic()
+            hibernate_servers(sessions, running, hibernating, idle_since, idle)
+        wake_servers(hibernating)
+
         for session in sessions:
-            app_name, server_name = session.split('-')
+            # stopped on purpose, running may still list them from before
+            if session in hibernating:
+                continue
+            s = sessions[session]['server']
 
             if sessions[session]['running']:
-                if not Server.running_check(app_name, server_name):
+                if session not in running:
                     sessions[session]['running'] = False
 
-                    info(server_name)
+                    info(s.server_name)
                     message('Status', 'Stopped')
 
                     if restart:
@@ -275,12 +453,14 @@ def monitor(apps, email, restart):
 
                         else:
                             sessions[session]['restarts'] += 1
-                            start(server_name)
+                            metrics.record('scsm_monitor_restarts_total', 1, increment=True,
+                                           app=s.app_name, server=s.server_name)
+                            start_servers([s])
             else:
-                if Server.running_check(app_name, server_name):
+                if session in running:
                     sessions[session]['running'] = True
 
-                    info(server_name)
+                    info(s.server_name)
                     message('Status', 'Running')
 
             if sessions[session]['time'] == 30:
@@ -292,10 +472,50 @@ def monitor(apps, email, restart):
         sleep(1)
 
 
+@main.command()
+@click.argument('apps', nargs=-1)
+@click.option('-c', '--compression', default=Config.retention_compression,
+              help='Recompression method')
+@click.option('-d', '--days', type=int, default=Config.retention_recompress_after,
+              help='Recompress backups older than days')
+@click.option('-n', '--no-recompress', is_flag=True, help='Only remove old backups')
+@add_options(JOB_OPTIONS)
+def prune(apps, compression, days, no_recompress, jobs):
+    '''Prune and recompress old backups'''
+
+    if compression not in ['bz2', 'gz', 'xz']:
+        message('Error', 'Invalid compression method')
+        return
+
+    # meant to run from a timer, only use otherwise idle cpu and disk time
+    set_priority(19, 'idle')
+
+    def job(app):
+        a = app_wrapper(app)
+        info(a.app_name, a.app_id)
+
+        if not a.backups:
+            message('Error', 'No backups found')
+            return False
+
+        removed = a.prune_backups(Config.max_backups, Config.retention_daily,
+                                  Config.retention_weekly, Config.retention_monthly)
+        message('Status', f'Removed {len(removed)} backups')
+
+        if not no_recompress:
+            message('Status', 'Recompressing')
+            recompressed = a.recompress_backups(compression, days)
+            message('Status', f'Recompressed {len(recompressed)} backups')
+        return True
+
+    run_jobs(job, app_special_names(apps), jobs)
+
+
 @main.command()
 @click.argument('apps', nargs=-1)
 @click.option('-f', '--force', is_flag=True, help='Run command even if running')
-def remove(apps, force):
+@add_options(JOB_OPTIONS)
+def remove(apps, force, jobs):
     '''Remove app'''
 
     if apps == ('steamcmd',):
@@ -307,7 +527,7 @@ def remove(apps, force):
             message('Status', 'SteamCMD removed')
 
     else:
-        for app in app_special_names(apps):
+        def job(app):
             a = app_wrapper(app)
             info(a.app_name, a.app_id)
 
@@ -315,82 +535,399 @@ def remove(apps, force):
                 message('Error', 'App not installed')
             elif not force and a.running:
                 message('Error', 'Stop server before validating')
+            elif a.installed_instances:
+                message('Error', f'Remove instances first: {", ".join(a.installed_instances)}')
             else:
                 message('Status', 'Removing')
                 a.remove()
                 message('Status', 'Remove complete')
+                return True
+            return False
+
+        run_jobs(job, app_special_names(apps), jobs)
 
 
 @main.command()
 @click.argument('apps', nargs=-1)
 @click.option('-w', '--wait-time', type=int, default=Config.wait_time, help='Wait time')
-@click.pass_context
-def restart(ctx, apps, wait_time):
+@add_options(READY_OPTIONS)
+@click.option('-r', '--rolling', is_flag=True, help='Restart in waves waiting for each to be ready')
+@click.option('-b', '--batch', type=int, default=1, help='Number of servers per rolling wave')
+def restart(apps, wait_time, wait, timeout, max_loading, rolling, batch):
     '''Restart server'''
 
-    for app in app_special_names(apps, server=True):
-        ctx.invoke(stop, apps=[app], wait_time=wait_time)
-        ctx.invoke(start, apps=[app], attach=False, debug=False)
+    servers = [*app_special_names(apps, server=True)]
+
+    if not rolling:
+        stop_servers(servers, wait_time)
+        start_servers(servers, wait=wait, timeout=timeout, max_loading=max_loading)
+        return
+
+    batch = max(batch, 1)
+    waves = [servers[i:i + batch] for i in range(0, len(servers), batch)]
+
+    for i, wave in enumerate(waves):
+        echo('[ ------ ]')
+        message('Status', f'Wave {i + 1} of {len(waves)}')
+
+        stop_servers(wave, wait_time)
+        failed = boot_servers([server_wrapper(app) for app in wave], len(wave), timeout)
+
+        if failed:
+            echo('[ ------ ]')
+            message('Error', f'Wave {i + 1} not ready: '
+                    f'{", ".join(s.server_name for s in failed)}')
+            message('Error', 'Rolling restart aborted')
+            sys.exit(1)
 
 
 @main.command()
 @click.argument('apps', nargs=-1)
 @click.option('-f', '--force', is_flag=True, help='Run command even if running')
 @click.option('-l', '--latest', is_flag=True, help='Select the latest backup automatically')
-def restore(apps, force, latest):
+@click.option('-s', '--s3', is_flag=True, help='Stream backup from S3 storage')
+@add_options(JOB_OPTIONS)
+def restore(apps, force, latest, s3, jobs):
     '''Restore app from backup'''
 
-    for app in app_special_names(apps):
+    apps = [*app_special_names(apps)]
+    storage = storage_wrapper() if s3 else None
+    selected = {}
+
+    def backups(a):
+        return storage.list(a.backup_key) if storage else a.backups
+
+    if jobs > 1 and len(apps) > 1 and not latest:
+        # prompts can not run inside parallel jobs so choose backups first
+        for app in apps:
+            a = app_wrapper(app)
+            if len(backups(a)) > 1:
+                info(a.app_name, a.app_id)
+                selected[app] = restore_select(backups(a))
+
+    def job(app):
         a = app_wrapper(app)
         info(a.app_name, a.app_id)
 
-        if not a.backup_dir.exists() or not os.listdir(a.backup_dir):
+        if not backups(a):
             message('Error', 'No backups found')
         elif not force and a.running:
             message('Error', 'Stop server before restoring')
         else:
-            backups = os.listdir(a.backup_dir)
-            backups.sort(reverse=True)
-            length = len(backups)
-
-            while length > 1 and not latest:
-                message('Status', 'Backups')
-                for i, backup in enumerate(backups):
-                    message(i + 1, backup)
-                answer = int(input(f'[ {click.style("Status", "green")} ] - Choose one: '))
-
-                if answer > length or answer < 1:
-                    message('Error', 'Invalid selection')
-                    click.echo('[ ------ ]')
-                else:
-                    backup = backups[answer - 1]
-                    break
+            if app in selected:
+                backup = selected[app]
+            elif latest:
+                backup = backups(a)[-1]
             else:
-                backup = backups[0]
+                backup = restore_select(backups(a))
 
             a.app_dir.mkdir(parents=True, exist_ok=True)
             message('Status', 'Restoring')
-            a.restore(backup)
+            a.restore(backup, storage)
             message('Status', 'Restore complete')
+            return True
+        return False
+
+    run_jobs(job, apps, jobs)
+
+
+def start_servers(servers, attach=False, debug=False, wait=False, timeout=None, max_loading=0):
+    servers = sorted((server_wrapper(app) for app in servers),
+                     key=lambda s: s.priority, reverse=True)
+
+    if max_loading > 0 and not (attach or debug):
+        return boot_servers(servers, max_loading, timeout)
+
+    for s in servers:
+        info(s.server_name)
+
+        if not s.installed:
+            message('Error', 'App not installed')
+        elif s.running:
+            message('Error', 'Already running')
+        else:
+            message('Status', 'Starting')
+            s.start(debug)
+            message('Status', 'Started')
+
+            if wait and not debug:
+                seconds = s.wait_ready(timeout)
+                if seconds is None:
+                    message('Error', 'Not ready')
+                else:
+                    message('Status', f'Ready in {seconds:.1f} seconds')
+
+            if attach or debug:
+                s.console()
+            if debug and s.running:
+                # kill any left open tmux debugging session
+                message('Status', 'Killing')
+                s.kill()
+                message('Status', 'Stopped')
+
+
+def boot_servers(servers, max_loading, timeout=None):
+    '''Start servers keeping at most max_loading of them loading at once
+
+    A loading server releases its slot once it is ready, exits or reaches
+    its ready timeout. Returns the servers that did not become ready.
+    '''
+    queue = [*servers]
+    loading = []
+    failed = []
+
+    while queue or loading:
+        while queue and len(loading) < max_loading:
+            s = queue.pop(0)
+            info(s.server_name)
+
+            if not s.installed:
+                message('Error', 'App not installed')
+                failed.append(s)
+            elif s.running:
+                message('Error', 'Already running')
+                failed.append(s)
+            else:
+                message('Status', 'Starting')
+                s.start()
+                message('Status', 'Started')
+                loading.append(s)
+
+        sleep(0.5)
+
+        for s in [*loading]:
+            seconds = monotonic() - s.started
+            limit = timeout or s.ready_options.get('timeout', 300)
+
+            if s.ready:
+                s.record_ready(seconds)
+                info(s.server_name)
+                message('Status', f'Ready in {seconds:.1f} seconds')
+            elif not s.running:
+                info(s.server_name)
+                message('Error', 'Exited while loading')
+                failed.append(s)
+            elif seconds >= limit:
+                info(s.server_name)
+                message('Error', f'Not ready after {limit} seconds')
+                failed.append(s)
+            else:
+                continue
+            loading.remove(s)
+    return failed
+
+
+def stop_servers(servers, wait_time):
+    '''Stop all servers at once and wait for them against a single deadline'''
+    stopping = []
+    sessions = Server.running_sessions()
+
+    for app in servers:
+        s = server_wrapper(app)
+        info(s.server_name)
+
+        if not s.installed:
+            message('Error', 'App not installed')
+        elif s.session_name not in sessions:
+            message('Error', 'Stopped')
+        else:
+            message('Status', 'Stopping')
+            s.stop()
+            stopping.append(s)
+
+    deadline = monotonic() + int(wait_time)
+    remaining = stopping
+
+    while remaining and monotonic() < deadline:
+        sleep(0.5)
+        sessions = Server.running_sessions()
+        remaining = [s for s in remaining if s.session_name in sessions]
+
+    for s in stopping:
+        # repeat the name when the output of several servers is interleaved
+        if len(stopping) > 1:
+            info(s.server_name)
+
+        if s in remaining:
+            message('Error', f'Waited {wait_time} seconds')
+            message('Error', 'Killing')
+            s.kill()
+
+        message('Status', 'Stopped')
+
+
+def follow_logs(servers, pattern=None):
+    '''Print new log lines of all servers as they are written'''
+    if len(servers) == 1:
+        for line in log.follow(servers[0].log_dir, pattern):
+            click.echo(line.decode(errors='replace'))
+        return
+
+    lines = Queue()
+
+    def worker(s):
+        for line in log.follow(s.log_dir, pattern):
+            lines.put((s.server_name, line))
+
+    for s in servers:
+        threading.Thread(target=worker, args=(s,), daemon=True).start()
+
+    while True:
+        name, line = lines.get()
+        click.echo(f'{click.style(name, "yellow")}: {line.decode(errors="replace")}')
+
+
+def hibernate_servers(sessions, running, hibernating, idle_since, idle):
+    '''Stop servers without players for idle minutes and hold their ports'''
+    servers = [state['server'] for session, state in sessions.items()
+               if session in running and session not in hibernating]
+    servers = [s for s in servers if s.query_address and s.listen_ports]
+    replies = query_all([s.query_address for s in servers], 2)
+
+    for s, reply in zip(servers, replies):
+        # no reply means loading or not answering, neither is idle
+        if reply is None or reply['players'] - reply['bots'] > 0:
+            idle_since.pop(s.session_name, None)
+            continue
+
+        since = idle_since.setdefault(s.session_name, monotonic())
+        if monotonic() - since < idle * 60:
+            continue
+
+        info(s.server_name)
+        message('Status', f'No players for {idle} minutes, hibernating')
+        # stopped on purpose, so not reported or restarted by monitor
+        sessions[s.session_name]['running'] = False
+        idle_since.pop(s.session_name)
+        stop_servers([s], Config.wait_time)
+
+        try:
+            hibernating[s.session_name] = (s, Waker(s.listen_ports))
+        except OSError as e:
+            message('Error', e)
+
+
+def watch_servers(sessions, running, watchdogs):
+    '''Check servers with watchdog options and act on the ones that hang'''
+    for session in [*watchdogs]:
+        if session not in running:
+            del watchdogs[session]
+
+    for session in sessions:
+        if session in running and session not in watchdogs:
+            s = sessions[session]['server']
+            if s.watchdog_options:
+                watchdogs[session] = Watchdog(s)
+
+    queried = [w for w in watchdogs.values()
+               if w.options['query_timeout'] and w.server.query_address]
+    replies = dict(zip(queried, query_all([w.server.query_address for w in queried], 2)))
+
+    for session, w in [*watchdogs.items()]:
+        reasons = w.check(replies.get(w))
+        if not reasons:
+            continue
+
+        s = w.server
+        info(s.server_name)
+        for reason in reasons:
+            message('Alert', f'Hung, {reason}')
+        message('Status', f'Incident recorded in {w.record(reasons)}')
+        metrics.record('scsm_watchdog_hangs_total', 1, increment=True, app=s.app_name,
+                       server=s.server_name)
+        del watchdogs[session]
+
+        action = w.options['action']
+        if action in ('kill', 'restart'):
+            # restarted on purpose, so not reported or restarted again by monitor
+            sessions[session]['running'] = False
+            if action == 'kill':
+                message('Status', 'Killing')
+                s.kill()
+            else:
+                stop_servers([s], Config.wait_time)
+            start_servers([s])
+
+
+def wake_servers(hibernating):
+    '''Start hibernating servers a client has connected to'''
+    for session, (s, waker) in [*hibernating.items()]:
+        if waker.woken:
+            # hand the ports back before the server binds them
+            waker.close()
+            del hibernating[session]
+            info(s.server_name)
+            message('Status', 'Client connected, waking')
+            start_servers([s])
+
+
+def restore_select(backups):
+    backups = sorted(backups, reverse=True)
+    length = len(backups)
+
+    while length > 1:
+        message('Status', 'Backups')
+        for i, backup in enumerate(backups):
+            message(i + 1, backup)
+        answer = int(input(f'[ {click.style("Status", "green")} ] - Choose one: '))
+
+        if answer > length or answer < 1:
+            message('Error', 'Invalid selection')
+            echo('[ ------ ]')
+        else:
+            return backups[answer - 1]
+    return backups[0]
 
 
 @main.command()
 @click.argument('command')
 @click.argument('apps', nargs=-1)
-def send(apps, command):
+@click.option('-c', '--capture', is_flag=True, help='Print the output of the command')
+@click.option('-r', '--regex', help='Capture until a line matches regex')
+@click.option('-s', '--settle', type=float, default=0.5,
+              help='Capture until no output for settle seconds')
+@click.option('-t', '--timeout', type=float, default=5, help='Capture timeout in seconds')
+def send(apps, command, capture, regex, settle, timeout):
     '''Send command to server'''
 
+    servers, ready = [], []
+    sessions = Server.running_sessions()
+
     for app in app_special_names(apps, server=True):
         s = server_wrapper(app)
+        servers.append(s)
+        if s.installed and s.session_name in sessions:
+            ready.append(s)
+
+    if capture:
+        def job(s):
+            try:
+                return '\n'.join(s.send_capture(command, timeout, settle, regex)), None
+            except (rcon.RCONError, OSError, re.error) as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            results = dict(zip(ready, executor.map(job, ready)))
+    else:
+        # send to every server at once and report in order
+        results = dict(zip(ready, Server.send_all(ready, command)))
+
+    for s in servers:
         info(s.server_name)
 
         if not s.installed:
             message('Error', 'App not installed')
-        elif not s.running:
+        elif s not in results:
             message('Error', 'Stopped')
         else:
+            output, error = results[s]
+            if error:
+                message('Error', error)
+                continue
+
             message('Status', 'Command sent')
-            s.send(command)
+            for line in (output or '').splitlines():
+                echo(line)
             message('Status', 'Command finished')
 
 
@@ -399,7 +936,7 @@ def send(apps, command):
 def setup(system_wide):
     '''Setup SteamCMD and config files'''
 
-    click.echo('[ ------ ]')
+    echo('[ ------ ]')
 
     if Config.config_f and Config.config_f.exists():
         if not system_wide and Config.system_wide:
@@ -426,43 +963,81 @@ def setup(system_wide):
 @click.argument('apps', nargs=-1)
 @click.option('-a', '--attach', is_flag=True, help='Attach to starting server session')
 @click.option('-d', '--debug', is_flag=True, help='Debug mode')
-def start(apps, attach, debug):
+@add_options(READY_OPTIONS)
+def start(apps, attach, debug, wait, timeout, max_loading):
     '''Start server'''
 
-    for app in app_special_names(apps, server=True):
-        s = server_wrapper(app)
-        info(s.server_name)
+    start_servers(app_special_names(apps, server=True), attach, debug, wait, timeout,
+                  max_loading)
 
-        if not s.installed:
-            message('Error', 'App not installed')
-        elif s.running:
-            message('Error', 'Already running')
-        else:
-            message('Status', 'Starting')
-            s.start(debug)
-            message('Status', 'Started')
 
-            if attach or debug:
-                s.console()
-            if debug and s.running:
-                # kill any left open tmux debugging session
-                message('Status', 'Killing')
-                s.kill()
-                message('Status', 'Stopped')
+def show_limits(given, errors):
+    '''Show the limits a server was given at launch'''
+    if 'cpu_affinity' in given:
+        message('CPUs', given['cpu_affinity'])
+    if 'nice' in given or 'ionice' in given:
+        message('Nice', f'{given.get("nice", 0)}, I/O {given.get("ionice", "default")}')
+    for key, (soft, hard) in given.get('rlimits', {}).items():
+        message('Limit', f'{key} {soft}' if soft == hard else f'{key} {soft}/{hard}')
+    if 'cpu_max' in given:
+        message('Cgroup', f'CPU max {given["cpu_max"]:.0f}%')
+    if 'memory_max' in given:
+        message('Cgroup', f'Memory max {human_size(given["memory_max"])}')
+    for error in errors:
+        message('Alert', f'Limit not applied: {error}')
 
 
 @main.command()
 @click.argument('apps', nargs=-1)
-def status(apps):
+@click.option('-r', '--resources', is_flag=True, help='Show resource usage and limits')
+@click.option('-p', '--players', is_flag=True, help='List players')
+@click.option('-t', '--timeout', type=float, default=1, help='Query timeout in seconds')
+def status(apps, resources, players, timeout):
     '''Status server'''
 
-    for app in app_special_names(apps, server=True):
-        s = server_wrapper(app)
+    servers = [server_wrapper(app) for app in app_special_names(apps, server=True)]
+    running = [s for s in servers if s.installed and s.running]
+
+    if resources:
+        # rates need two samples, take them for all servers at once
+        for s in running:
+            s.sample()
+        sleep(1)
+
+    # query every server concurrently instead of waiting on each in turn
+    queried = [s for s in running if s.query_address]
+    replies = dict(zip([s.session_name for s in queried],
+                       query_all([s.query_address for s in queried], timeout, players)))
+
+    for s in servers:
         info(s.server_name)
         if not s.installed:
             message('Error', 'App not installed')
-        elif s.running:
+        elif s in running:
             message('Status', 'Running')
+            if s.session_name in replies:
+                reply = replies[s.session_name]
+                if reply:
+                    message('Query', f'{reply["players"]}/{reply["max_players"]} players '
+                                     f'on {reply["map"]} in {reply["rtt"]:.0f} ms')
+                    for player in reply.get('player_list', []):
+                        message('Player', player['name'])
+                else:
+                    message('Alert', 'No query response')
+
+            usage = s.sample() if resources else None
+            if usage:
+                message('CPU', f'{usage["cpu_percent"]:.1f}%')
+                message('Memory', human_size(usage['rss']))
+                message('Tasks', f'{usage["processes"]} processes, '
+                                 f'{usage["threads"]} threads')
+                message('Files', f'{usage["files"]} open')
+                message('Disk', f'Read {human_size(int(usage["read_rate"]))}/s, '
+                                f'write {human_size(int(usage["write_rate"]))}/s')
+
+            given = s.given_limits() if resources else None
+            if given:
+                show_limits(*given)
         else:
             message('Status', 'Stopped')
 
@@ -473,28 +1048,7 @@ def status(apps):
 def stop(apps, wait_time):
     '''Stop server'''
 
-    for app in app_special_names(apps, server=True):
-        s = server_wrapper(app)
-        info(s.server_name)
-
-        if not s.installed:
-            message('Error', 'App not installed')
-        elif not s.running:
-            message('Error', 'Stopped')
-        else:
-            message('Status', 'Stopping')
-            s.stop()
-
-            for i in range(int(wait_time)):
-                if not s.running:
-                    break
-                sleep(1)
-            else:
-                message('Error', f'Waited {wait_time} seconds')
-                message('Error', 'Killing')
-                s.kill()
-
-            message('Status', 'Stopped')
+    stop_servers(app_special_names(apps, server=True), wait_time)
 
 
 @main.command()
@@ -505,12 +1059,17 @@ def stop(apps, wait_time):
 def update(apps, username, password, steam_guard, force, validate):
     '''Update app'''
 
+    updated = set()
     for app in app_special_names(apps):
         a = app_wrapper(app)
         steamcmd_check()
         info(a.app_name, a.app_id)
 
-        if not force and a.running:
+        if a.install_dir in updated:
+            message('Status', 'Updated with shared install')
+            if a.workshop_items:
+                update_workshop(a, username, password, steam_guard, validate)
+        elif not force and a.shared_running:
             message('Error', 'Stop server before update')
         elif not a.installed:
             # no subscription installs leave games partially installed
@@ -518,10 +1077,13 @@ def update(apps, username, password, steam_guard, force, validate):
             steamcmd = SteamCMD()
             if steamcmd.license(a.app_id, username, password, steam_guard):
                 message('Status', 'Installing')
-                exit_code = a.update(username, password, steam_guard, validate)
+                exit_code = update_app(a, username, password, steam_guard, validate)
 
                 if exit_code == 0:
+                    updated.add(a.install_dir)
                     message('Status', 'Installed')
+                    if a.workshop_items:
+                        update_workshop(a, username, password, steam_guard, validate)
                 else:
                     message('Error', 'Install failed')
             else:
@@ -532,19 +1094,60 @@ def update(apps, username, password, steam_guard, force, validate):
             else:
                 message('Status', 'Updating')
 
-            exit_code = a.update(username, password, steam_guard, validate)
+            exit_code = update_app(a, username, password, steam_guard, validate)
 
             if exit_code == 0:
+                updated.add(a.install_dir)
                 message('Status', 'Updated')
+                if a.workshop_items:
+                    update_workshop(a, username, password, steam_guard, validate)
             else:
                 message('Error', 'Update failed')
 
 
+def update_workshop(a, username, password, steam_guard, validate):
+    '''Update the app's workshop items'''
+    message('Status', 'Checking workshop items')
+    exit_code, items = a.update_workshop(username, password, steam_guard, validate)
+
+    if exit_code != 0:
+        message('Error', 'Workshop update failed')
+    elif items:
+        message('Status', f'Workshop items updated: {len(items)}')
+    else:
+        message('Status', 'Workshop items up to date')
+    return exit_code
+
+
+def backup_metrics(a, seconds, size):
+    metrics.record('scsm_backup_duration_seconds', round(seconds, 3), app=a.app_name)
+    metrics.record('scsm_backup_size_bytes', size, app=a.app_name)
+    metrics.record('scsm_backup_last_success_timestamp_seconds', int(time()), app=a.app_name)
+
+
+def update_app(a, username, password, steam_guard, validate):
+    '''Update app recording its duration and result in the metrics'''
+    if a.depots and not a.use_depots:
+        message('Warn', 'Depots can not use app_config or a beta password, updating all')
+
+    started = monotonic()
+    exit_code = a.update(username, password, steam_guard, validate)
+
+    if exit_code == 0:
+        metrics.record('scsm_update_duration_seconds', round(monotonic() - started, 3),
+                       app=a.app_name)
+        metrics.record('scsm_update_last_success_timestamp_seconds', int(time()),
+                       app=a.app_name)
+    else:
+        metrics.record('scsm_update_failures_total', 1, increment=True, app=a.app_name)
+    return exit_code
+
+
 def app_wrapper(app):
     try:
         a = App(app, Config.app_dir, Config.backup_dir)
     except FileNotFoundError:
-        click.echo('[ ------ ]')
+        echo('[ ------ ]')
 
         try:
             int(app)
@@ -560,10 +1163,14 @@ def app_wrapper(app):
 
 
 def server_wrapper(app):
+    # servers built with a server override are used as they are
+    if isinstance(app, Server):
+        return app
+
     try:
         s = Server(app, Config.app_dir)
     except FileNotFoundError:
-        click.echo('[ ------ ]')
+        echo('[ ------ ]')
 
         try:
             int(app)
@@ -590,7 +1197,8 @@ def app_special_names(apps, server=False):
         for app in Index.list(Config.app_dir):
             s = Server(app, Config.app_dir)
 
-            if s.running:
+            # s.running only checks the app's first server
+            if Server.running_check(s.app_name):
                 for server in s.server_names:
                     if Server.running_check(s.app_name, server):
                         if status == 'running':
@@ -624,24 +1232,86 @@ def server_expand_names(apps):
                 yield app
 
 
+def echo(text):
+    buffer = getattr(_output, 'buffer', None)
+    if buffer is None:
+        click.echo(text)
+    else:
+        buffer.append(text)
+
+
 def info(name, app_id=None):
-    click.echo('[ ------ ]')
+    echo('[ ------ ]')
     message('Name', name)
     if app_id:
         message('App ID', app_id)
 
 
 def message(title, text):
-    if title in ['Name', 'App ID', 'F-Name']:
+    if title in ['Name', 'App ID', 'F-Name', 'Size']:
         color = 'yellow'
     elif title in ['Status', 'Done']:
         color = 'green'
-    elif title in ['Error', 'Alert']:
+    elif title in ['Error', 'Alert', 'Failed']:
         color = 'red'
+    elif title in ['Skip', 'Warn']:
+        color = 'yellow'
     else:
         color = 'white'
 
-    click.echo(f'[ {click.style(str(title).ljust(6), color)} ] - {text}')
+    echo(f'[ {click.style(str(title).ljust(6), color)} ] - {text}')
+
+
+def run_job(func, app):
+    '''Run a single job and return its result'''
+    try:
+        if func(app) is False:
+            return 'Skip'
+        return 'Done'
+    except Exception as e:
+        message('Error', e)
+        return 'Failed'
+
+
+def run_jobs(func, apps, jobs=1):
+    '''Run func for every app using a pool of workers
+
+    Output of each job is buffered and printed in the order of apps. A job
+    that returns False is skipped, one that raises has failed. Exits with 1
+    if any job failed.
+    '''
+    apps = [*apps]
+    results = []
+
+    if jobs <= 1 or len(apps) <= 1:
+        for app in apps:
+            results.append(run_job(func, app))
+    else:
+        def worker(app):
+            _output.buffer = []
+            try:
+                result = run_job(func, app)
+            except SystemExit:
+                result = 'Failed'
+            finally:
+                output, _output.buffer = _output.buffer, None
+            return result, output
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # results are collected in submission order so output stays ordered
+            for future in [executor.submit(worker, app) for app in apps]:
+                result, output = future.result()
+                for line in output:
+                    click.echo(line)
+                results.append(result)
+
+        echo('[ ------ ]')
+        for app, result in zip(apps, results):
+            message(result, app)
+
+    if 'Failed' in results:
+        sys.exit(1)
+    return results
 
 
 def signal_handler(signal, frame):
@@ -650,10 +1320,24 @@ def signal_handler(signal, frame):
     sys.exit(0)
 
 
+def storage_wrapper():
+    if not Config.s3.get('bucket'):
+        echo('[ ------ ]')
+        message('Error', 'No S3 bucket configured')
+        sys.exit(1)
+
+    try:
+        return S3Storage(**Config.s3)
+    except ImportError as e:
+        echo('[ ------ ]')
+        message('Error', e)
+        sys.exit(1)
+
+
 def steamcmd_check():
     steamcmd = SteamCMD()
     if not steamcmd.installed:
-        click.echo('[ ------ ]')
+        echo('[ ------ ]')
         message('Error', 'SteamCMD not installed')
         steamcmd_install()
 
@@ -662,7 +1346,7 @@ def steamcmd_check():
 
 
 def steamcmd_install():
-    click.echo('[ ------ ]')
+    echo('[ ------ ]')
     message('Status', 'SteamCMD installing')
 
     steamcmd = SteamCMD()
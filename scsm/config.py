@@ -15,14 +15,51 @@ else:
 
 
 DEFAULTS = f"""
+    backup:
+        drop_cache: true
+        ionice:
+        nice: 0
+        rate_limit: 0
+    retention:
+        daily: 0
+        weekly: 0
+        monthly: 0
+        recompress: xz
+        recompress_after: 1
     general:
+        backend: tmux
         compression: gz
+        hibernate: 0
+        instance_mode: auto
+        jobs: 1
         steam_guard: true
         max_backups: 5
+        max_loading: 0
         wait_time: 30
     directories:
         app_dir: {Path(BASE_DIR, 'apps')}
         backup_dir: {Path(BASE_DIR, 'backups')}
+        log_dir: {Path(BASE_DIR, 'logs')}
+        state_dir: {Path(BASE_DIR, 'state')}
+        workshop_dir: {Path(BASE_DIR, 'workshop')}
+    logs:
+        enabled: true
+        compression: gz
+        max_age: 24
+        max_size: 10
+        max_total: 100
+    metrics:
+        listen: 127.0.0.1:9633
+        textfile:
+    s3:
+        bucket:
+        prefix: scsm
+        endpoint_url:
+        region:
+        access_key:
+        secret_key:
+        part_size: 16
+        workers: 4
     steam:
         username: anonymous
         password:
@@ -49,12 +86,37 @@ class Config():
     else:
         data = yaml.safe_load(DEFAULTS)
 
+    backend = str(data['general'].get('backend', 'tmux'))
     compression = str(data['general']['compression'])
+    hibernate = int(data['general'].get('hibernate', 0))
+    instance_mode = str(data['general'].get('instance_mode', 'auto'))
+    jobs = int(data['general'].get('jobs', 1))
     steam_guard = str(data['general']['steam_guard'])
     max_backups = int(data['general']['max_backups'])
+    max_loading = int(data['general'].get('max_loading', 0))
     wait_time = int(data['general']['wait_time'])
     app_dir = Path(data['directories']['app_dir'])
     backup_dir = Path(data['directories']['backup_dir'])
+    log_dir = Path(data['directories'].get('log_dir', Path(BASE_DIR, 'logs')))
+    state_dir = Path(data['directories'].get('state_dir', Path(BASE_DIR, 'state')))
+    workshop_dir = Path(data['directories'].get('workshop_dir', Path(BASE_DIR, 'workshop')))
+    backup_drop_cache = bool(data.get('backup', {}).get('drop_cache', True))
+    backup_ionice = data.get('backup', {}).get('ionice')
+    backup_nice = int(data.get('backup', {}).get('nice', 0))
+    backup_rate_limit = float(data.get('backup', {}).get('rate_limit', 0))
+    retention_daily = int(data.get('retention', {}).get('daily', 0))
+    retention_weekly = int(data.get('retention', {}).get('weekly', 0))
+    retention_monthly = int(data.get('retention', {}).get('monthly', 0))
+    retention_compression = str(data.get('retention', {}).get('recompress', 'xz'))
+    retention_recompress_after = int(data.get('retention', {}).get('recompress_after', 1))
+    log_enabled = bool(data.get('logs', {}).get('enabled', True))
+    log_compression = str(data.get('logs', {}).get('compression', 'gz') or '')
+    log_max_age = float(data.get('logs', {}).get('max_age', 24))
+    log_max_size = float(data.get('logs', {}).get('max_size', 10))
+    log_max_total = float(data.get('logs', {}).get('max_total', 100))
+    metrics_listen = str(data.get('metrics', {}).get('listen') or '127.0.0.1:9633')
+    metrics_textfile = data.get('metrics', {}).get('textfile')
+    s3 = data.get('s3') or {}
     username = str(data['steam']['username'])
     password = str(data['steam']['password'])
 
@@ -1,10 +1,22 @@
+import bz2
+import gzip
+import io
+import json
+import lzma
 import os
 import platform as pf
+import re
+import shlex
 import shutil
+import socket
 import subprocess
+import sys
 import tarfile
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
+from time import monotonic, sleep
 from urllib.request import urlretrieve
 from zipfile import ZipFile
 
@@ -12,7 +24,20 @@ import libtmux
 import vdf
 import yaml
 
+from . import disk, instance, limits, metrics, proc, rcon, workshop
+from .a2s import A2S_INFO
 from .config import Config
+from .supervisor import SupervisorBackend
+
+
+BACKUP_DATE = '%Y-%m-%d-%H%M%S'
+BACKUP_EXTENSIONS = ['.tar', '.tar.bz2', '.tar.gz', '.tar.xz']
+# resource samples kept per server
+SAMPLES = 60
+# lines used to find the cursor again after the pane history dropped lines
+ANCHOR_LINES = 5
+CODECS = {'': io, 'bz2': bz2, 'gz': gzip, 'xz': lzma}
+STEAM_PLATFORMS = {'Darwin': 'macos', 'Linux': 'linux', 'Windows': 'windows'}
 
 
 class App():
@@ -37,20 +62,36 @@ class App():
         if not self.app_name:
             self.app_name = self.app_names[0]
 
-        self.server_names = list(data['apps'][self.app_name]['servers'].keys())
+        # instances share the install of another app_name, inheriting its config
+        self.instance_of = data['apps'][self.app_name].get('instance_of')
+        install_name = self.instance_of or self.app_name
+        self.instance_names = [name for name, app in data['apps'].items()
+                               if app.get('instance_of') == install_name]
 
-        data = data['apps'][self.app_name]
+        if self.instance_of:
+            data = {**data['apps'][self.instance_of], **data['apps'][self.app_name]}
+        else:
+            data = data['apps'][self.app_name]
         self.full_name = data['fname']
+        self.server_config = data['servers']
+        self.server_names = list(self.server_config.keys())
+        self.writable_paths = data.get('writable') or []
 
         if self.server_name:
             self.start_options = data['servers'][self.server_name]['start']
             self.stop_options = data['servers'][self.server_name]['stop']
 
         self.app_dir = Path(app_dir, str(self.app_id), self.app_name)
+        self.install_dir = Path(app_dir, str(self.app_id), install_name)
+        # writable overlay layer, hidden so it is not listed as an app
+        self.layer_dir = Path(app_dir, str(self.app_id), f'.{self.app_name}')
         if backup_dir:
             self.backup_dir = Path(backup_dir, str(self.app_id), self.app_name)
 
         self.beta, self.beta_password, self.app_config = None, None, None
+        self.prewarm_paths = []
+        self.workshop_app_id, self.workshop_items, self.workshop_path = self.app_id, [], None
+        self.depots, self.languages = None, ['english']
         for key in data.keys():
             if key == 'beta':
                 self.beta = data['beta']
@@ -58,6 +99,22 @@ class App():
                 self.beta_password = data['password']
             elif key == 'app_config':
                 self.app_config = data['app_config']
+            elif key == 'prewarm':
+                self.prewarm_paths = data['prewarm']
+            elif key == 'depots':
+                # auto selects depots by platform, arch and language
+                depots = data['depots']
+                self.depots = depots if depots == 'auto' else [int(d) for d in depots]
+            elif key == 'languages':
+                self.languages = data['languages']
+            elif key == 'workshop':
+                # either a list of item ids or a dict with the items and options
+                options = data['workshop']
+                if isinstance(options, list):
+                    options = {'items': options}
+                self.workshop_app_id = int(options.get('app_id', self.app_id))
+                self.workshop_items = [int(item) for item in options.get('items') or []]
+                self.workshop_path = options.get('path')
 
         if not platform:
             self.platform = pf.system()
@@ -83,10 +140,23 @@ class App():
                 elif key == 'library':
                     self.library = data['library']
 
+    @property
+    def backup_key(self):
+        '''Return object storage path of the app's backups'''
+        return f'{self.app_id}/{self.app_name}'
+
+    @property
+    def backups(self):
+        '''Return backup file names sorted from oldest to newest'''
+        if not self.backup_dir.exists():
+            return []
+        return sorted(f for f in os.listdir(self.backup_dir)
+                      if not f.startswith('.') and App.backup_date(f))
+
     @property
     def build_id_local(self):
         '''Return the app's local build id'''
-        f = Path(self.app_dir, 'steamapps', f'appmanifest_{self.app_id}.acf')
+        f = Path(self.install_dir, 'steamapps', f'appmanifest_{self.app_id}.acf')
 
         if f.is_file():
             with open(f, 'r') as app_manifest:
@@ -109,8 +179,8 @@ class App():
     @property
     def installed(self):
         '''Return True if app is installed'''
-        if self.app_dir.exists():
-            for d in self.app_dir.iterdir():
+        if self.install_dir.exists():
+            for d in self.install_dir.iterdir():
                 # if only steamapps directory is found
                 # then it did not completely install
                 if d != 'steamapps':
@@ -125,20 +195,256 @@ class App():
             return Server.running_check(self.app_name)
         return False
 
-    def backup(self, compression=None):
-        '''Backup app to backup_dir using tar'''
+    @property
+    def shared_names(self):
+        '''Return app_names using this app's install'''
+        return [self.instance_of or self.app_name, *self.instance_names]
+
+    @property
+    def use_depots(self):
+        '''Return True if depots are downloaded on their own instead of app_update'''
+        # download_depot can not set the app config or unlock password branches
+        return bool(self.depots) and not (self.app_config or self.beta_password)
+
+    @property
+    def installed_instances(self):
+        '''Return installed instances of this app's install if it is not one'''
+        if self.instance_of:
+            return []
+        return [name for name in self.instance_names
+                if Path(self.app_dir.parent, name).exists()]
+
+    @property
+    def shared_running(self):
+        '''Return True if any app using this app's install is running'''
+        if self.platform != 'Windows':
+            return any(Server.running_check(name) for name in self.shared_names)
+        return False
+
+    def backup(self, compression=None, rate_limit=0, drop_cache=False, storage=None):
+        '''Backup app to backup_dir or storage using tar
+
+        rate_limit caps reads in bytes per second and drop_cache drops
+        files from the page cache once they have been read. If storage is
+        given the archive is streamed to it instead of written to backup_dir.
+        '''
         if not compression:
             compression = ''
             extension = '.tar'
         else:
             extension = f'.tar.{compression}'
 
-        date = datetime.now().strftime("%Y-%m-%d-%H%M%S")
+        date = datetime.now().strftime(BACKUP_DATE)
         f = Path(self.backup_dir, f'{date}{extension}')
 
-        with tarfile.open(f, f'w:{compression}') as tar:
-            os.chdir(self.app_dir.parent)
-            tar.add(self.app_name)
+        if storage:
+            fileobj = storage.open(f'{self.backup_key}/{f.name}', 'wb')
+        else:
+            fileobj = open(f, 'wb')
+
+        with fileobj:
+            # arcname instead of chdir so backups can run in parallel threads
+            with tarfile.open(fileobj=fileobj, mode=f'w|{compression}') as tar:
+                if rate_limit or drop_cache:
+                    limiter = disk.RateLimiter(rate_limit) if rate_limit else None
+                    self._backup_add(tar, limiter, drop_cache)
+                else:
+                    tar.add(self.app_dir, arcname=self.app_name)
+
+            # dirty pages are not dropped, so write them out first where
+            # they can be dropped at all
+            if drop_cache and not storage and hasattr(os, 'posix_fadvise'):
+                fileobj.flush()
+                os.fdatasync(fileobj.fileno())
+                disk.drop_cache(fileobj.fileno())
+        return f
+
+    def _backup_add(self, tar, limiter=None, drop_cache=False):
+        '''Add app_dir to tar reading regular files through ThrottledReader'''
+        for root, dirs, files in os.walk(self.app_dir):
+            dirs.sort()
+            arcroot = Path(self.app_name, Path(root).relative_to(self.app_dir))
+            tar.addfile(tar.gettarinfo(root, str(arcroot)))
+
+            for name in sorted(files):
+                tarinfo = tar.gettarinfo(Path(root, name), str(Path(arcroot, name)))
+                if tarinfo.isreg():
+                    with disk.ThrottledReader(open(Path(root, name), 'rb'),
+                                              limiter, drop_cache) as reader:
+                        tar.addfile(tarinfo, reader)
+                else:
+                    tar.addfile(tarinfo)
+
+            # symlinks to directories are stored as links, not followed
+            for name in dirs:
+                if Path(root, name).is_symlink():
+                    tar.addfile(tar.gettarinfo(Path(root, name), str(Path(arcroot, name))))
+
+    @staticmethod
+    def backup_date(backup):
+        '''Return datetime a backup was made from its file name or None
+
+        Files that are not named like a backup, like manual copies or
+        partial uploads, return None.
+        '''
+        name, _, extension = backup.partition('.')
+        if f'.{extension}' not in BACKUP_EXTENSIONS:
+            return None
+        try:
+            return datetime.strptime(name, BACKUP_DATE)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def retention(backups, latest=0, daily=0, weekly=0, monthly=0):
+        '''Return set of backups to keep
+
+        Keeps the newest latest backups and the newest backup of each of the
+        last daily days, weekly weeks and monthly months. Keeps everything if
+        no limit is set.
+        '''
+        # files that are not backups are always kept
+        other = {backup for backup in backups if not App.backup_date(backup)}
+        backups = sorted(set(backups) - other, reverse=True)
+        if not any([latest, daily, weekly, monthly]):
+            return set(backups) | other
+
+        keep = set(backups[:latest])
+        tiers = [(daily, lambda d: d.date()),
+                 (weekly, lambda d: d.isocalendar()[:2]),
+                 (monthly, lambda d: (d.year, d.month))]
+
+        for count, period in tiers:
+            seen = set()
+            for backup in backups:
+                if len(seen) == count:
+                    break
+                key = period(App.backup_date(backup))
+                if key not in seen:
+                    seen.add(key)
+                    keep.add(backup)
+        return keep | other
+
+    def prune_backups(self, latest=0, daily=0, weekly=0, monthly=0):
+        '''Remove backups not kept by the retention policy'''
+        backups = self.backups
+        keep = App.retention(backups, latest, daily, weekly, monthly)
+
+        removed = [backup for backup in backups if backup not in keep]
+        for backup in removed:
+            Path(self.backup_dir, backup).unlink()
+        return removed
+
+    def recompress_backups(self, compression='xz', days=1):
+        '''Recompress backups older than days using compression'''
+        recompressed = []
+        extension = f'.tar.{compression}' if compression else '.tar'
+        cutoff = datetime.now() - timedelta(days=days)
+
+        for backup in self.backups:
+            name, _, current = backup.partition('.tar')
+            if current.lstrip('.') == compression or App.backup_date(backup) > cutoff:
+                continue
+
+            src = Path(self.backup_dir, backup)
+            dst = Path(self.backup_dir, f'{name}{extension}')
+            # hidden temporary file so it is never listed as a backup
+            tmp = Path(self.backup_dir, f'.{name}{extension}.tmp')
+
+            with CODECS[current.lstrip('.')].open(src, 'rb') as fsrc, \
+                    CODECS[compression].open(tmp, 'wb') as fdst:
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+            shutil.copystat(src, tmp)
+            tmp.rename(dst)
+            src.unlink()
+            recompressed.append(dst.name)
+        return recompressed
+
+    def build_instance(self, refresh=False):
+        '''Build the instance directory on top of the shared install
+
+        Overlay instances are mounted once, link farms are only rebuilt if
+        they do not exist yet unless refresh is set, like after an update.
+        Returns 0 on success.
+        '''
+        if not self.instance_of:
+            return 0
+
+        mode = instance.resolve_mode(Config.instance_mode)
+        if mode == 'overlay':
+            if os.path.ismount(self.app_dir):
+                # the shared install changed underneath, remount if possible
+                if not refresh or self.running or instance.unmount(self.app_dir):
+                    return 0
+            exit_code = instance.mount(self.install_dir, self.layer_dir, self.app_dir)
+            if exit_code == 0 or Config.instance_mode != 'auto':
+                return exit_code
+
+        if refresh or not Path(self.app_dir, instance.MANIFEST).exists():
+            instance.link_farm(self.install_dir, self.app_dir, self.writable_paths,
+                               hardlink=mode == 'hardlink')
+        return 0
+
+    def update_depots(self, username='anonymous', password='',
+                      steam_guard='', validate=False):
+        '''Update only the allowed depots of the app using steamcmd
+
+        Depots are downloaded only when the branch's build changed, or with
+        validate, and a manifest is written so build_id_local keeps working.
+        '''
+        steamcmd = SteamCMD()
+        data = steamcmd.info(self.app_id)
+        branch = self.beta or 'public'
+        build_id = int(data['depots']['branches'][branch]['buildid'])
+
+        if not validate and self.installed and build_id == self.build_id_local:
+            return 0
+
+        if self.depots == 'auto':
+            depots = SteamCMD.select_depots(data, self.platform, self.arch, self.languages)
+        else:
+            depots = self.depots
+        manifests = SteamCMD.depot_manifests(data, depots, branch)
+
+        exit_code = steamcmd.depot_download(self.app_id, manifests, self.install_dir,
+                                            self.platform, username, password,
+                                            steam_guard, SteamCMD.shared_depots(data, depots))
+        if exit_code == 0:
+            f = Path(self.install_dir, 'steamapps', f'appmanifest_{self.app_id}.acf')
+            f.parent.mkdir(parents=True, exist_ok=True)
+            state = {'AppState': {
+                'appid': str(self.app_id), 'buildid': str(build_id),
+                'InstalledDepots': {str(depot): {'manifest': str(manifest or '')}
+                                    for depot, manifest in manifests.items()}}}
+            with open(f, 'w') as app_manifest:
+                vdf.dump(state, app_manifest, pretty=True)
+        return exit_code
+
+    def update_workshop(self, username='anonymous', password='',
+                        steam_guard='', validate=False):
+        '''Download workshop items that are missing or outdated using steamcmd
+
+        Items are kept in a cache shared by every app and downloaded in a
+        single steamcmd run. Returns the exit code and the items downloaded.
+        '''
+        if validate:
+            items = self.workshop_items
+        else:
+            items = workshop.outdated(Config.workshop_dir, self.workshop_app_id,
+                                      self.workshop_items)
+
+        exit_code = 0
+        if items:
+            steamcmd = SteamCMD()
+            exit_code = steamcmd.workshop_download(self.workshop_app_id, items,
+                                                   Config.workshop_dir, validate,
+                                                   username, password, steam_guard)
+
+        if self.workshop_path:
+            workshop.link(Config.workshop_dir, self.workshop_app_id, self.workshop_items,
+                          Path(self.app_dir, self.workshop_path))
+        return exit_code, items
 
     def copy_config(self):
         '''Copy default app config file to config_dir'''
@@ -149,6 +455,14 @@ class App():
 
     def remove(self):
         '''Remove app directory'''
+        if self.installed_instances:
+            raise ValueError(f'{self.app_name} is used by {", ".join(self.installed_instances)}')
+        if self.instance_of:
+            instance.unmount(self.app_dir)
+            if self.layer_dir.exists():
+                shutil.rmtree(self.layer_dir)
+            if not self.app_dir.exists():
+                return
         shutil.rmtree(self.app_dir)
 
         # if this app is the only one installed for that app_id
@@ -157,23 +471,36 @@ class App():
         if not os.listdir(app_dir):
             app_dir.rmdir()
 
-    def restore(self, backup):
-        '''Restore specified backup file'''
-        with tarfile.open(Path(self.backup_dir, backup)) as tar:
-            def is_within_directory(directory, target):
-                abs_directory = os.path.abspath(directory)
-                abs_target = os.path.abspath(target)
-                prefix = os.path.commonprefix([abs_directory, abs_target])
-                return prefix == abs_directory
-
-            def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
-                for member in tar.getmembers():
-                    member_path = os.path.join(path, member.name)
-                    if not is_within_directory(path, member_path):
-                        raise Exception("Attempted Path Traversal in Tar File")
-                tar.extractall(path, members, numeric_owner=numeric_owner) 
-
-            safe_extract(tar, self.app_dir.parent)
+    def restore(self, backup, storage=None):
+        '''Restore specified backup file, streamed from storage if given'''
+        def is_within_directory(directory, target):
+            abs_directory = os.path.abspath(directory)
+            abs_target = os.path.abspath(target)
+            prefix = os.path.commonprefix([abs_directory, abs_target])
+            return prefix == abs_directory
+
+        def safe_extract(tar, path=".", members=None, *, numeric_owner=False):
+            for member in tar.getmembers():
+                member_path = os.path.join(path, member.name)
+                if not is_within_directory(path, member_path):
+                    raise Exception("Attempted Path Traversal in Tar File")
+            tar.extractall(path, members, numeric_owner=numeric_owner)
+
+        def safe_extract_stream(tar, path="."):
+            # members of a stream can only be checked as they are read
+            for member in tar:
+                member_path = os.path.join(path, member.name)
+                if not is_within_directory(path, member_path):
+                    raise Exception("Attempted Path Traversal in Tar File")
+                tar.extract(member, path)
+
+        if storage:
+            with storage.open(f'{self.backup_key}/{backup}', 'rb') as fileobj:
+                with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+                    safe_extract_stream(tar, self.app_dir.parent)
+        else:
+            with tarfile.open(Path(self.backup_dir, backup)) as tar:
+                safe_extract(tar, self.app_dir.parent)
 
         if self.config_is_default:
             self.copy_config()
@@ -184,12 +511,30 @@ class App():
         if self.config_is_default:
             self.copy_config()
 
+        # steamcmd must not write under mounted overlays, running ones are
+        # left alone as the update is refused or forced while they run
+        instances = [App(name, self.app_dir.parents[1], platform=self.platform)
+                     for name in self.instance_names]
+        for a in instances:
+            if os.path.ismount(a.app_dir) and not a.running:
+                instance.unmount(a.app_dir)
+
         steamcmd = SteamCMD()
-        return steamcmd.app_update(self.app_id, self.app_dir,
-                                   self.beta, self.beta_password,
-                                   self.app_config, self.platform,
-                                   validate, username, password,
-                                   steam_guard)
+        if self.use_depots:
+            exit_code = self.update_depots(username, password, steam_guard, validate)
+        else:
+            exit_code = steamcmd.app_update(self.app_id, self.install_dir,
+                                            self.beta, self.beta_password,
+                                            self.app_config, self.platform,
+                                            validate, username, password,
+                                            steam_guard)
+
+        # one update serves every instance of the install, a failed update
+        # only remounts the instances unmounted above
+        refresh = exit_code == 0
+        for a in instances:
+            exit_code = a.build_instance(refresh) or exit_code
+        return exit_code
 
 
 class Index():
@@ -217,7 +562,9 @@ class Index():
         for app_id in directory.iterdir():
             if len(data[int(app_id.name)].keys()) > 1:
                 for app_name in Path(directory, app_id).iterdir():
-                    yield app_name.name
+                    # instance layers are hidden
+                    if not app_name.name.startswith('.'):
+                        yield app_name.name
             else:
                 yield app_id.name
 
@@ -270,70 +617,347 @@ class Index():
                     with open(Path(d, f), 'r') as config_f:
                         data = yaml.safe_load(config_f)
 
-                    for app in data['apps'].keys():
-                        app_index[data['app_id']] = {app: list(data['apps'][app]
-                                                               ['servers'].keys())}
+                    # instances without servers of their own use the shared app's
+                    apps = data['apps']
+                    app_index[data['app_id']] = {
+                        app: list({**apps.get(values.get('instance_of'), {}),
+                                   **values}['servers'].keys())
+                        for app, values in apps.items()}
 
         with open(Index.f, 'w') as f:
             yaml.dump(app_index, f)
 
 
 class Server(App):
-    def __init__(self, app, app_dir, backup_dir=None,  platform=None):
+    def __init__(self, app, app_dir, backup_dir=None,  platform=None, server=None):
         super(Server, self).__init__(app, app_dir, backup_dir, platform)
-        if not self.server_name:
+        # instances share server names with their app, so a name alone is ambiguous
+        if server:
+            self.server_name = server
+        elif not self.server_name:
             self.server_name = self.server_names[0]
 
-        self.tmux = libtmux.Server()
+        options = self.server_config[self.server_name]
+        self.start_options = options['start']
+        self.stop_options = options['stop']
+        self.ready_options = options.get('ready') or {}
+        self.rcon_options = options.get('rcon') or {}
+        self.watchdog_options = options.get('watchdog') or {}
+        self.limit_options = {key: options[key] for key in limits.KEYS if key in options}
+        # servers with a higher priority are started first
+        self.priority = int(options.get('priority', 0))
+
         self.session_name = f'{self.app_name}-{self.server_name}'
+        self.started = None
+        self._ready_line, self._ready_seen = 0, False
+        self._accessed, self._accessed_set = [], set()
+        self.samples = deque(maxlen=SAMPLES)
 
-        try:
-            self.session = self.tmux.sessions.filter(session_name=self.session_name)[0]
-        except IndexError:
-            self.session = None
+        if options.get('backend', Config.backend) == 'supervisor':
+            self.backend = SupervisorBackend(self.session_name, Path(Config.state_dir, 'run'))
+        else:
+            self.backend = TmuxBackend(self.session_name)
+
+    @property
+    def session(self):
+        '''Return tmux session if using the tmux backend'''
+        return getattr(self.backend, 'session', None)
+
+    @property
+    def access_f(self):
+        '''Return file with the order files were opened in on the last boot'''
+        return Path(Config.state_dir, 'prewarm', f'{self.session_name}.txt')
+
+    @property
+    def limits_f(self):
+        '''Return file with the limits applied on the last start'''
+        return Path(Config.state_dir, 'limits', f'{self.session_name}.json')
+
+    @property
+    def log_dir(self):
+        '''Return directory of the server's rotated output logs'''
+        return Path(Config.log_dir, self.session_name)
+
+    @property
+    def pid(self):
+        '''Return pid of the server process'''
+        return self.backend.pid
+
+    @property
+    def rcon(self):
+        '''Return pooled RCON connection if configured for the server or None'''
+        options = self.rcon_options
+        if not options:
+            return None
+        return rcon.connection(options.get('host', '127.0.0.1'), options['port'],
+                               str(options.get('password') or ''))
+
+    @property
+    def query_address(self):
+        '''Return host and port answering A2S queries or None'''
+        options = self.ready_options
+        port = options.get('query_port', options.get('port') if 'query' in options else None)
+        if port:
+            return options.get('host', '127.0.0.1'), int(port)
+        return None
+
+    @property
+    def listen_ports(self):
+        '''Return port and protocol pairs clients connect to from the ready options'''
+        options = self.ready_options
+        ports = []
+        if 'port' in options:
+            ports.append((int(options['port']), options.get('protocol', 'udp')))
+        if 'query_port' in options and (int(options['query_port']), 'udp') not in ports:
+            ports.append((int(options['query_port']), 'udp'))
+        return ports
+
+    @property
+    def ready(self):
+        '''Return True if all readiness probes from the app config pass
+
+        Probes are a log regex seen in the pane, a tcp or udp port in use
+        and a reply to an A2S_INFO query. Without probes a running server
+        is ready.
+        '''
+        if not self.running:
+            return False
+
+        if self.prewarm_paths and self.started:
+            self.sample_access()
+
+        options = self.ready_options
+        host = options.get('host', '127.0.0.1')
+
+        if 'log' in options:
+            lines, self._ready_line = self.capture(self._ready_line)
+            self._ready_seen = self._ready_seen or any(
+                re.search(options['log'], line) for line in lines)
+            if not self._ready_seen:
+                return False
+
+        if 'port' in options:
+            if not Server.port_check(options['port'], options.get('protocol', 'udp'), host):
+                return False
+
+        if 'query' in options:
+            port = options.get('query_port', options.get('port'))
+            if not Server.query_check(port, host):
+                return False
+        return True
+
+    def capture(self, start=0):
+        '''Return output lines from absolute line start and the next line index'''
+        return self.backend.capture(start)
+
+    def send_capture(self, command, timeout=5, settle=0.5, pattern=None):
+        '''Send command and return the lines of output it printed
+
+        Output is read incrementally from the line the cursor was on before
+        sending. It is complete once a line matches the regex pattern, or
+        without one once no new output appeared for settle seconds, or after
+        timeout seconds. RCON servers return the command's output directly.
+        '''
+        if self.rcon and command.lower() != 'c-c':
+            return self.send(command).splitlines()
+
+        start = self.backend.position()
+        self.send(command)
+
+        found, changed = {}, monotonic()
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            sleep(0.1)
+            lines, end = self.capture(start)
+            for i, line in enumerate(lines, start):
+                if found.get(i) != line:
+                    found[i], changed = line, monotonic()
+            start = end
+
+            if pattern:
+                if any(re.search(pattern, line) for line in found.values()):
+                    break
+            elif monotonic() - changed >= settle:
+                break
+
+        lines = [found[i] for i in sorted(found)]
+        # drop the console echo of the command and the empty prompt line
+        if lines and lines[0].rstrip().endswith(command):
+            lines.pop(0)
+        while lines and not lines[-1].strip():
+            lines.pop()
+        return lines
 
     @property
     def running(self):
-        '''Return True if app is running'''
-        if self.server_name == self.app_name:
-            return Server.running_check(self.app_name)
-        return Server.running_check(self.app_name, self.server_name)
+        '''Return True if server is running'''
+        return self.backend.running
 
     def console(self):
-        '''Attach to tmux session'''
-        self.session.attach_session()
+        '''Attach to server console'''
+        self.backend.console()
 
     def kill(self):
-        '''Kill tmux session'''
-        self.session.kill_session()
+        '''Kill server'''
+        self.backend.kill()
+
+    @staticmethod
+    def port_check(port, protocol='udp', host='127.0.0.1'):
+        '''Return True if a server is accepting traffic on port'''
+        if protocol == 'tcp':
+            try:
+                with socket.create_connection((host, port), timeout=1):
+                    return True
+            except OSError:
+                return False
+
+        # a udp port can only be seen as bound, check the kernel socket tables
+        tables = [Path('/proc/net/udp'), Path('/proc/net/udp6')]
+        if not any(f.exists() for f in tables):
+            return True
+
+        for f in tables:
+            if f.exists():
+                with open(f, 'r') as table:
+                    for line in table.readlines()[1:]:
+                        if int(line.split()[1].split(':')[1], 16) == int(port):
+                            return True
+        return False
+
+    @staticmethod
+    def query_check(port, host='127.0.0.1', timeout=1):
+        '''Return True if the server answers an A2S_INFO query'''
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            try:
+                sock.sendto(A2S_INFO, (host, int(port)))
+                return bool(sock.recv(1400))
+            except OSError:
+                return False
+
+    def prewarm(self, workers=8):
+        '''Load prewarm paths into the page cache before starting
+
+        Files opened during the last boot are loaded first in the order they
+        were opened in, followed by the rest of the configured paths.
+        '''
+        files = []
+        if self.access_f.is_file():
+            with open(self.access_f, 'r') as f:
+                files = [line.rstrip('\n') for line in f if line.strip()]
+
+        seen = set(files)
+        for path in self.prewarm_paths:
+            path = Path(self.exec_dir, path)
+            if path.is_file():
+                paths = [str(path)]
+            else:
+                paths = [str(Path(root, name)) for root, _, names in os.walk(path)
+                         for name in sorted(names)]
+            files.extend(f for f in paths if f not in seen)
+            seen.update(paths)
+        return disk.prewarm(files, workers)
+
+    def record_ready(self, seconds):
+        '''Append time to ready to the server's start history'''
+        f = Path(Config.state_dir, 'ready', f'{self.session_name}.csv')
+        f.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(f, 'a') as history:
+            history.write(f'{datetime.now().isoformat(timespec="seconds")},'
+                          f'{seconds:.2f},{self.build_id_local}\n')
+
+        if self.prewarm_paths and self._accessed:
+            self.access_f.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.access_f, 'w') as f:
+                f.writelines(f'{path}\n' for path in self._accessed)
+
+    def sample(self):
+        '''Sample resource usage of the server's process tree
+
+        Samples are kept in a ring buffer. CPU percent and disk read and
+        write rates are calculated against the previous sample, so they are
+        zero on the first one. Returns None if the server is not running.
+        '''
+        try:
+            pid = self.pid
+        except (AttributeError, IndexError, ValueError):
+            return None
+        if not pid:
+            return None
+
+        usage = proc.usage(pid)
+        previous = self.samples[-1] if self.samples else usage
+        self.samples.append(usage)
+        return {**usage, **proc.rates(previous, usage)}
+
+    def sample_access(self):
+        '''Record files under app_dir the server has open, in first seen order'''
+        app_dir = f'{self.app_dir}{os.sep}'
+        try:
+            pids = proc.children(self.pid)
+        except (AttributeError, IndexError, ValueError):
+            return
+
+        for pid in pids:
+            for path in proc.open_files(pid):
+                if path.startswith(app_dir) and path not in self._accessed_set:
+                    self._accessed_set.add(path)
+                    self._accessed.append(path)
 
     @staticmethod
     def running_check(app_name, server_name=None):
         '''Check if server or app is running'''
-        tmux = libtmux.Server()
+        sessions = Server.running_sessions()
 
         if server_name:
+            return f'{app_name}-{server_name}' in sessions
+        return any(session.startswith(f'{app_name}-') for session in sessions)
+
+    @staticmethod
+    def running_sessions():
+        '''Return set of running session names of all backends'''
+        return TmuxBackend.sessions() | SupervisorBackend.sessions(Path(Config.state_dir, 'run'))
+
+    @staticmethod
+    def send_all(servers, command, workers=16):
+        '''Send command to many servers at once
+
+        Tmux consoles are all sent to with a single tmux call, RCON and
+        supervised servers in parallel. Returns a list of output and error
+        pairs in the order of servers.
+        '''
+        def console(s):
+            return isinstance(s.backend, TmuxBackend) and not (s.rcon and command.lower() != 'c-c')
+
+        def send(s):
             try:
-                session = tmux.sessions.filter(f'{app_name}-{server_name}')[0]
-                if session:
-                    return True
-                return False
-            except IndexError:
-                return False
-        else:
-            for session in tmux.sessions:
-                if session.name.startswith(f'{app_name}-'):
-                    return True
-            return False
+                return s.send(command), None
+            except (rcon.RCONError, OSError) as e:
+                return None, e
 
-    def send(self, command):
-        '''Send command to tmux session'''
-        pane = self.session.windows[0].panes[0]
-        # suppress_history and literal must be false for c-c to work
-        pane.send_keys(command, enter=True, suppress_history=False, literal=False)
+        results = [None] * len(servers)
+        tmux = [i for i, s in enumerate(servers) if console(s)]
+        others = [i for i, s in enumerate(servers) if not console(s)]
 
-    def start(self, debug=False):
-        '''Start server'''
+        errors = TmuxBackend.send_many([servers[i].session_name for i in tmux], command)
+        for i, error in zip(tmux, errors):
+            results[i] = (None, error)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i, result in zip(others, executor.map(send, [servers[i] for i in others])):
+                results[i] = result
+        return results
+
+    def send(self, command):
+        '''Send command to server, returning its output if sent over RCON'''
+        if self.rcon and command.lower() != 'c-c':
+            return self.rcon.command(command)
+        self.backend.send(command)
+        return None
+
+    def start(self, debug=False, prewarm=True):
+        '''Start server, loading prewarm paths into the page cache first'''
         if self.library:
             cmd = f'LD_LIBRARY_PATH={self.library} {self.exe} '
         else:
@@ -346,26 +970,253 @@ class Server(App):
         else:
             cmd += ' '.join(self.start_options)
 
-        if debug:
-            # tmux session stays open even if server exits
-            self.session = self.tmux.new_session(session_name=self.session_name,
-                                                 start_directory=self.exec_dir)
-            self.send(cmd)
-        else:
-            self.session = self.tmux.new_session(session_name=self.session_name,
-                                                 start_directory=self.exec_dir,
-                                                 window_command=cmd)
+        self.started = monotonic()
+        self._ready_line, self._ready_seen = 0, False
+        self._accessed, self._accessed_set = [], set()
+
+        self.build_instance()
+        if prewarm and self.prewarm_paths:
+            self.prewarm()
+
+        if self.limit_options:
+            # limits are applied by a launcher and inherited by the server
+            cmd = ' '.join(shlex.quote(arg) for arg in [
+                sys.executable, '-m', 'scsm.limits', str(self.limits_f),
+                json.dumps(self.limit_options), cmd])
+
+        log_dir = self.log_dir if Config.log_enabled else None
+        self.backend.start(cmd, self.exec_dir, debug, log_dir)
+
+        try:
+            metrics.record_start(self.session_name, self.app_name, self.server_name, self.pid)
+        except (AttributeError, IndexError, OSError, ValueError):
+            pass
+
+    def given_limits(self):
+        '''Return the limits the running server was given and any errors'''
+        try:
+            with open(self.limits_f, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # the launcher execs the server command, so its pid stays in the server's tree
+        if not self.running or state['pid'] not in proc.children(self.pid):
+            return None
+        rlimits = [*(self.limit_options.get('rlimits') or {})]
+        return limits.current(state['pid'], rlimits), state.get('errors', [])
+
+    def wait_ready(self, timeout=None, interval=0.5):
+        '''Wait until the server is ready
+
+        Returns seconds since start and records them, or None on timeout or
+        if the server exits.
+        '''
+        if timeout is None:
+            timeout = self.ready_options.get('timeout', 300)
+        started = self.started or monotonic()
+
+        while monotonic() - started < timeout:
+            if self.ready:
+                seconds = monotonic() - started
+                self.record_ready(seconds)
+                return seconds
+            if not self.running:
+                return None
+            sleep(interval)
+        return None
 
     def stop(self):
         '''Stop server'''
         if self.stop_options:
             for command in self.stop_options:
-                self.send(command)
+                if self.rcon:
+                    # the server closing the connection acknowledges quit
+                    try:
+                        self.rcon.command(command, expect_close=True)
+                        continue
+                    except (rcon.RCONError, OSError):
+                        pass
+                self.backend.send(command)
         else:
             # Send Ctrl - C to tmux session to stop server
             self.send('c-c')
 
 
+class TmuxBackend():
+    '''Execution backend running servers in tmux sessions'''
+    def __init__(self, name):
+        self.name = name
+        self.tmux = libtmux.Server()
+        self._session = None
+        # lines dropped by the history limit since the pane was first read
+        self._dropped, self._end, self._anchor = 0, 0, None
+
+    @property
+    def session(self):
+        '''Return tmux session, looked up on first use so creating is cheap'''
+        if self._session is None:
+            try:
+                self._session = self.tmux.sessions.filter(session_name=self.name)[0]
+            except IndexError:
+                pass
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+
+    @property
+    def pane(self):
+        '''Return the session's tmux pane'''
+        return self.session.windows[0].panes[0]
+
+    @property
+    def pid(self):
+        '''Return pid of the process running in the pane'''
+        return int(self.pane.pane_pid)
+
+    @property
+    def running(self):
+        '''Return True if the session exists'''
+        return self.name in TmuxBackend.sessions()
+
+    @staticmethod
+    def sessions():
+        '''Return set of tmux session names using a single tmux call'''
+        # without a server socket there are no sessions, skip forking tmux
+        if not os.getenv('TMUX'):
+            tmp_dir = os.getenv('TMUX_TMPDIR', '/tmp')
+            if not Path(tmp_dir, f'tmux-{os.getuid()}', 'default').exists():
+                return set()
+
+        try:
+            return set(libtmux.Server().cmd('list-sessions', '-F', '#{session_name}').stdout)
+        except libtmux.exc.LibTmuxException:
+            return set()
+
+    def capture(self, start=0):
+        '''Return pane lines from absolute line start and the next line index
+
+        Line indexes count from the oldest line in the pane history when it
+        was first read. If lines from start already dropped off the history
+        the whole history is returned.
+        '''
+        history_size, cursor_y = self._cursor()
+        end = self._dropped + history_size + cursor_y
+
+        first = max(start - self._dropped - history_size, -history_size)
+        lines = self.pane.cmd('capture-pane', '-p', '-S', str(first),
+                              '-E', str(cursor_y)).stdout
+        # capture-pane leaves out trailing empty lines
+        lines += [''] * (cursor_y - first + 1 - len(lines))
+        # the cursor line may still be written to, so it is read again next time
+        return lines, end
+
+    def _cursor(self):
+        '''Return history size and cursor row, tracking lines dropped from the history'''
+        out = self.pane.cmd('display-message', '-p',
+                            '#{history_size} #{cursor_y} #{history_limit}').stdout
+        history_size, cursor_y, limit = (int(i) for i in out[0].split())
+
+        # a full history drops its oldest tenth at a time, the lines above the
+        # cursor are found again at a whole number of drops to know how many
+        step = max(limit // 10, 1)
+        if history_size >= limit - 2 * step:
+            rows = self.pane.cmd('capture-pane', '-p', '-S', str(-history_size),
+                                 '-E', str(cursor_y - 1)).stdout
+            rows += [''] * (history_size + cursor_y - len(rows))
+
+            if self._anchor:
+                index, anchor = self._anchor
+                last = min(index - self._dropped, len(rows) - len(anchor))
+                for i in range(last - (last - index + self._dropped) % step, -1, -step):
+                    if rows[i:i + len(anchor)] == anchor:
+                        self._dropped = index - i
+                        break
+                else:
+                    # the anchor is gone too, at least keep indexes from going back
+                    self._dropped = max(self._dropped, self._end - history_size - cursor_y)
+
+            anchor = rows[-ANCHOR_LINES:]
+            if any(line.strip() for line in anchor):
+                self._anchor = (self._dropped + len(rows) - len(anchor), anchor)
+
+        self._end = self._dropped + history_size + cursor_y
+        return history_size, cursor_y
+
+    def position(self):
+        '''Return absolute line index of the cursor'''
+        history_size, cursor_y = self._cursor()
+        return self._dropped + history_size + cursor_y
+
+    def console(self):
+        '''Attach to tmux session'''
+        self.session.attach_session()
+
+    def kill(self):
+        '''Kill tmux session'''
+        # the session may have exited on its own since it was looked up
+        self.tmux.cmd('kill-session', '-t', f'={self.name}')
+
+    @staticmethod
+    def send_many(names, command):
+        '''Send command to many tmux sessions with a single tmux call
+
+        Returns a list with an error or None for every name.
+        '''
+        running = TmuxBackend.sessions()
+        errors = {name: 'Stopped' for name in names if name not in running}
+        pending = [name for name in names if name in running]
+
+        while pending:
+            # each send prints its index, tmux stops the chain at the first error
+            args = []
+            for i, name in enumerate(pending):
+                args += [';', 'send-keys', '-t', f'={name}:', command, 'Enter',
+                         ';', 'display-message', '-p', str(i)]
+            result = libtmux.Server().cmd(*args[1:])
+            if not result.stderr:
+                break
+
+            failed = len(result.stdout)
+            if failed >= len(pending):
+                break
+            errors[pending[failed]] = result.stderr[0]
+            pending = pending[failed + 1:]
+        return [errors.get(name) for name in names]
+
+    def send(self, command):
+        '''Send command to tmux session'''
+        # suppress_history and literal must be false for c-c to work
+        self.pane.send_keys(command, enter=True, suppress_history=False, literal=False)
+
+    def start(self, cmd, cwd, debug=False, log_dir=None):
+        '''Start cmd in a new tmux session, piping its output to a log in log_dir'''
+        if debug:
+            # tmux session stays open even if server exits
+            self.session = self.tmux.new_session(session_name=self.name,
+                                                 start_directory=cwd)
+            self.pipe(log_dir)
+            self.send(cmd)
+        else:
+            if log_dir:
+                # hold the server back until its output is piped to the log
+                cmd = f'tmux wait-for {shlex.quote(self.name)}; {cmd}'
+            self.session = self.tmux.new_session(session_name=self.name,
+                                                 start_directory=cwd,
+                                                 window_command=cmd)
+            self.pipe(log_dir)
+            if log_dir:
+                self.tmux.cmd('wait-for', '-S', self.name)
+
+    def pipe(self, log_dir):
+        '''Pipe pane output to the log writer'''
+        if log_dir:
+            writer = f'{shlex.quote(sys.executable)} -m scsm.logs {shlex.quote(str(log_dir))}'
+            self.pane.cmd('pipe-pane', '-o', f'exec {writer}')
+
+
 class SteamCMD():
     def __init__(self):
         if shutil.which('steamcmd'):
@@ -413,6 +1264,112 @@ class SteamCMD():
 
         return self.run(cmd)
 
+    @staticmethod
+    def select_depots(data, platform, arch='64bit', languages=('english',)):
+        '''Return depot ids from app info that are needed on platform
+
+        Depots for other operating systems, architectures or languages are
+        left out. Depots shared from other apps, like the steamworks redist,
+        are kept and downloaded from their own app.
+        '''
+        oslist = STEAM_PLATFORMS[platform]
+        depots = []
+        for depot, values in data.get('depots', {}).items():
+            if not depot.isdigit() or not isinstance(values, dict):
+                continue
+            if 'manifests' not in values and 'depotfromapp' not in values:
+                continue
+
+            config = values.get('config', {})
+            if config.get('oslist') and oslist not in config['oslist'].split(','):
+                continue
+            if config.get('osarch') and config['osarch'] != arch.replace('bit', ''):
+                continue
+            if config.get('language') and config['language'] not in languages:
+                continue
+            depots.append(int(depot))
+        return depots
+
+    @staticmethod
+    def shared_depots(data, depots):
+        '''Return dict of depot ids shared from other apps and the app they are from'''
+        shared = {}
+        for depot in depots:
+            from_app = data['depots'].get(str(depot), {}).get('depotfromapp')
+            if from_app:
+                shared[depot] = int(from_app)
+        return shared
+
+    @staticmethod
+    def depot_manifests(data, depots, branch='public'):
+        '''Return dict of depot ids and their manifest id on branch or None'''
+        manifests = {}
+        for depot in depots:
+            manifest = data['depots'].get(str(depot), {}).get('manifests', {}).get(branch)
+            # newer app info has a dict with the manifest gid and sizes
+            if isinstance(manifest, dict):
+                manifest = manifest.get('gid')
+            manifests[depot] = manifest
+        return manifests
+
+    def depot_download(self, app_id, manifests, app_dir, platform=None,
+                       username='anonymous', password='', steam_guard='', shared=None):
+        '''+download_depot wrapper downloading every depot into app_dir in one run
+
+        Depots in shared are downloaded from the app they are shared from.
+        '''
+        shared = shared or {}
+        cmd = ['+force_install_dir', app_dir, '+login', username, password,
+               steam_guard]
+        for depot, manifest in manifests.items():
+            cmd += ['+download_depot', str(shared.get(depot, app_id)), str(depot)]
+            if manifest:
+                cmd.append(str(manifest))
+        cmd.append('+quit')
+
+        if platform and platform != pf.system():
+            cmd.insert(0, f'+@sSteamCmdForcePlatformType {STEAM_PLATFORMS[platform]}')
+
+        exit_code = self.run(cmd)
+        if exit_code != 0:
+            return exit_code
+
+        # depots are downloaded to a content directory, merge them into app_dir
+        # older steamcmd versions ignore force_install_dir for depots
+        dirs = [app_dir]
+        if hasattr(self, 'directory'):
+            dirs += [self.directory, Path(self.directory, 'linux32')]
+
+        for depot in manifests:
+            for d in dirs:
+                src = Path(d, 'steamapps', 'content', f'app_{shared.get(depot, app_id)}',
+                           f'depot_{depot}')
+                if src.is_dir():
+                    shutil.copytree(src, app_dir, copy_function=shutil.move,
+                                    dirs_exist_ok=True)
+                    shutil.rmtree(src)
+                    break
+            else:
+                return 1
+
+        content = Path(app_dir, 'steamapps', 'content')
+        if content.exists():
+            shutil.rmtree(content)
+        return 0
+
+    def workshop_download(self, app_id, items, directory, validate=False,
+                          username='anonymous', password='', steam_guard=''):
+        '''+workshop_download_item wrapper downloading every item in one run'''
+        cmd = ['+force_install_dir', directory, '+login', username, password,
+               steam_guard]
+        for item in items:
+            cmd += ['+workshop_download_item', str(app_id), str(item)]
+            if validate:
+                cmd.append('validate')
+        cmd.append('+quit')
+
+        return self.run(cmd)
+
     def cached_login(self, username):
         '''Check if user has a cached login'''
         cmd = [self.exe, '+login', username, '+quit']
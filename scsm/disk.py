@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from time import monotonic, sleep
+
+
+IONICE_CLASSES = {'realtime': '1', 'best-effort': '2', 'idle': '3'}
+
+# drop read pages from the page cache every 8 MiB
+DROP_CACHE_SIZE = 8 * 1024 * 1024
+
+
+def drop_cache(fd, offset=0, length=0):
+    '''Tell the kernel the given range of fd is no longer needed'''
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+def human_size(size):
+    '''Return size in bytes as a human readable string'''
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if size < 1024 or unit == 'TiB':
+            break
+        size /= 1024
+    return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+
+
+def prewarm(files, workers=8):
+    '''Load files into the page cache in parallel, in the given order
+
+    Returns the number of bytes requested.
+    '''
+    def load(f):
+        try:
+            fd = os.open(f, os.O_RDONLY)
+        except OSError:
+            return 0
+
+        try:
+            size = os.fstat(fd).st_size
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while os.read(fd, 1024 * 1024):
+                    pass
+            return size
+        except OSError:
+            return 0
+        finally:
+            os.close(fd)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(load, files))
+
+
+def set_priority(nice=0, ionice=None):
+    '''Lower CPU and I/O scheduling priority of the current process
+
+    Threads started afterwards inherit both priorities.
+    '''
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+    if ionice and shutil.which('ionice'):
+        cmd = ['ionice', '-c', IONICE_CLASSES[ionice], '-p', str(os.getpid())]
+        return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                              shell=False).returncode
+    return 0
+
+
+class RateLimiter():
+    '''Limit throughput to rate bytes per second, shared between threads'''
+    def __init__(self, rate):
+        self.rate = rate
+        self.start = monotonic()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        '''Account for size bytes and sleep if ahead of the rate'''
+        with self.lock:
+            now = monotonic()
+            # do not let an idle period build up an unlimited burst
+            if self.total / self.rate < now - self.start - 1:
+                self.start, self.total = now, 0
+            self.total += size
+            delay = self.total / self.rate - (now - self.start)
+
+        if delay > 0:
+            sleep(delay)
+
+
+class ThrottledReader():
+    '''File object wrapper with an optional rate limit and page cache dropping'''
+    def __init__(self, f, limiter=None, drop=False):
+        self.f = f
+        self.limiter = limiter
+        self.drop = drop
+        self.offset = 0
+        self.dropped = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.offset += len(data)
+
+        if self.limiter and data:
+            self.limiter.consume(len(data))
+        if self.drop and (not data or self.offset - self.dropped >= DROP_CACHE_SIZE):
+            drop_cache(self.f.fileno(), self.dropped, self.offset - self.dropped)
+            self.dropped = self.offset
+        return data
+
+    def close(self):
+        if self.drop:
+            drop_cache(self.f.fileno())
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DiskUsage():
+    '''Parallel disk usage walker with a per directory size cache
+
+    The size of the files directly in a directory and its list of
+    subdirectories are cached keyed on the directory mtime, so unchanged
+    directories only cost a single stat. The mtime only changes when entries
+    are added, removed or renamed, so files growing in place are picked up the
+    next time their directory changes.
+    '''
+    def __init__(self, cache_f=None, workers=8):
+        self.cache_f = cache_f
+        self.workers = workers
+        self.cache = {}
+        self.seen = set()
+        self.roots = []
+
+        if cache_f and Path(cache_f).is_file():
+            try:
+                with open(cache_f, 'r') as f:
+                    self.cache = json.load(f)
+            except ValueError:
+                pass
+
+    def _scan(self, path):
+        '''Return size of files directly in path and its subdirectories'''
+        try:
+            st = os.stat(path, follow_symlinks=False)
+        except OSError:
+            return 0, []
+        mtime = st.st_mtime_ns
+
+        self.seen.add(path)
+        cached = self.cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        size, subdirs = getattr(st, 'st_blocks', 0) * 512, []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        else:
+                            st = entry.stat(follow_symlinks=False)
+                            # allocated size like du, apparent size if unknown
+                            size += getattr(st, 'st_blocks', st.st_size // 512) * 512
+                    except OSError:
+                        pass
+        except OSError:
+            return 0, []
+
+        self.cache[path] = [mtime, size, subdirs]
+        return size, subdirs
+
+    def size(self, path):
+        '''Return total size of path in bytes'''
+        path = str(path)
+        if not os.path.isdir(path):
+            return os.path.getsize(path) if os.path.isfile(path) else 0
+
+        self.roots.append(path)
+        total = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self._scan, path)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    size, subdirs = future.result()
+                    total += size
+                    pending.update(executor.submit(self._scan, d) for d in subdirs)
+        return total
+
+    def save(self):
+        '''Write cache dropping directories that no longer exist'''
+        if not self.cache_f:
+            return
+
+        def stale(path):
+            return path not in self.seen and any(
+                path == root or path.startswith(f'{root}{os.sep}') for root in self.roots)
+
+        cache = {path: entry for path, entry in self.cache.items() if not stale(path)}
+        Path(self.cache_f).parent.mkdir(parents=True, exist_ok=True)
+
+        tmp = Path(f'{self.cache_f}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(cache, f)
+        tmp.replace(self.cache_f)
@@ -0,0 +1,71 @@
+import selectors
+import socket
+import threading
+from time import sleep
+
+
+class Waker():
+    '''Hold the ports of a hibernating server and wait for a client
+
+    A udp packet, like a server browser query, or a tcp connection on any of
+    the ports wakes the server. The ports are released with close so the
+    server can bind them again.
+    '''
+    def __init__(self, ports, host='', retries=10):
+        self.event = threading.Event()
+        self.closed = False
+        self.selector = selectors.DefaultSelector()
+        self.socks = []
+
+        for port, protocol in ports:
+            kind = socket.SOCK_STREAM if protocol == 'tcp' else socket.SOCK_DGRAM
+            sock = socket.socket(socket.AF_INET, kind)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+            # the stopped server may take a moment to release its ports
+            for attempt in range(retries):
+                try:
+                    sock.bind((host, int(port)))
+                    break
+                except OSError:
+                    if attempt == retries - 1:
+                        self.close()
+                        sock.close()
+                        raise
+                    sleep(0.5)
+
+            if protocol == 'tcp':
+                sock.listen()
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, protocol)
+            self.socks.append(sock)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def woken(self):
+        '''Return True once a client has knocked'''
+        return self.event.is_set()
+
+    def run(self):
+        while not self.closed and not self.event.is_set():
+            for key, _ in self.selector.select(0.5):
+                try:
+                    if key.data == 'tcp':
+                        conn, _ = key.fileobj.accept()
+                        conn.close()
+                    else:
+                        key.fileobj.recvfrom(65536)
+                except OSError:
+                    continue
+                self.event.set()
+
+    def close(self):
+        '''Release the ports'''
+        self.closed = True
+        if getattr(self, 'thread', None) and self.thread is not threading.current_thread():
+            self.thread.join()
+        for sock in self.socks:
+            sock.close()
+        self.selector.close()
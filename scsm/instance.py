@@ -0,0 +1,161 @@
+import os
+import shutil
+import subprocess
+from fnmatch import fnmatch
+from pathlib import Path
+
+
+MODES = ['auto', 'overlay', 'symlink', 'hardlink']
+# paths linked by link_farm, kept so a rebuild knows which files it owns
+MANIFEST = '.scsm-links'
+
+
+def overlay_available():
+    '''Return True if overlayfs can be mounted by this process'''
+    if os.geteuid() == 0 and shutil.which('mount'):
+        try:
+            with open('/proc/filesystems', 'r') as f:
+                if 'overlay' in f.read().split():
+                    return True
+        except OSError:
+            pass
+    return bool(shutil.which('fuse-overlayfs'))
+
+
+def resolve_mode(mode='auto'):
+    '''Return the instance mode to use for mode'''
+    if mode not in MODES:
+        raise ValueError(f'Invalid instance mode {mode}')
+    if mode == 'auto':
+        return 'overlay' if overlay_available() else 'symlink'
+    return mode
+
+
+def mount(lower, layer_dir, merged):
+    '''Mount an overlay of lower with the writable layer_dir on merged'''
+    upper, work = Path(layer_dir, 'upper'), Path(layer_dir, 'work')
+    for d in upper, work, Path(merged):
+        d.mkdir(parents=True, exist_ok=True)
+
+    options = f'lowerdir={lower},upperdir={upper},workdir={work}'
+    if os.geteuid() == 0 and shutil.which('mount'):
+        cmd = ['mount', '-t', 'overlay', 'overlay', '-o', options, str(merged)]
+    else:
+        cmd = ['fuse-overlayfs', '-o', options, str(merged)]
+    return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                          shell=False).returncode
+
+
+def unmount(merged):
+    '''Unmount an overlay if merged is mounted'''
+    if not os.path.ismount(merged):
+        return 0
+    if os.geteuid() == 0 and shutil.which('umount'):
+        cmd = ['umount', str(merged)]
+    else:
+        cmd = ['fusermount', '-u', str(merged)]
+    return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                          shell=False).returncode
+
+
+def is_writable(path, writable):
+    '''Return True if relative path is, or is under, one of the writable patterns'''
+    parts = Path(path).parts
+    for pattern in writable:
+        pattern = pattern.strip('/')
+        for i in range(1, len(parts) + 1):
+            if fnmatch('/'.join(parts[:i]), pattern):
+                return True
+    return False
+
+
+def _remove(path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+def _link(src, dst, hardlink):
+    if src.is_symlink():
+        os.symlink(os.readlink(src), dst)
+    elif hardlink:
+        try:
+            os.link(src, dst)
+        except OSError:
+            # hard links can not cross file systems
+            os.symlink(src, dst)
+    else:
+        os.symlink(src, dst)
+
+
+def link_farm(base, instance, writable=(), hardlink=False):
+    '''Mirror base into instance as links, copying writable paths
+
+    Directories are created for real so new files stay in the instance.
+    Files are linked to the base install, except those matching writable
+    which are copied once so the server can change them without changing
+    the base. Links to files that were removed from the base are removed and
+    files the server created itself are kept. Returns the number of links.
+    '''
+    base, instance = Path(base), Path(instance)
+    instance.mkdir(parents=True, exist_ok=True)
+    manifest_f = Path(instance, MANIFEST)
+
+    try:
+        with open(manifest_f, 'r') as f:
+            owned = set(f.read().splitlines())
+    except OSError:
+        owned = set()
+
+    links = set()
+    for root, dirs, files in os.walk(base):
+        rel_root = Path(root).relative_to(base)
+        # symlinked directories are not walked, they are linked as they are
+        for name in [d for d in dirs if Path(root, d).is_symlink()]:
+            dirs.remove(name)
+            files.append(name)
+
+        for name in dirs:
+            d = Path(instance, rel_root, name)
+            if d.is_symlink() or (d.exists() and not d.is_dir()):
+                d.unlink()
+            d.mkdir(exist_ok=True)
+
+        for name in files:
+            rel = str(Path(rel_root, name))
+            src, dst = Path(root, name), Path(instance, rel)
+
+            if is_writable(rel, writable):
+                # copy once, the server's changes are kept from then on
+                if rel in owned or not (dst.exists() or dst.is_symlink()):
+                    _remove(dst)
+                    if src.is_symlink():
+                        os.symlink(os.readlink(src), dst)
+                    else:
+                        shutil.copy2(src, dst)
+                continue
+
+            if dst.exists() or dst.is_symlink():
+                if rel not in owned:
+                    continue
+                if hardlink and not dst.is_symlink() and os.path.samefile(src, dst):
+                    links.add(rel)
+                    continue
+                if not hardlink and dst.is_symlink() and os.readlink(dst) == str(src):
+                    links.add(rel)
+                    continue
+                _remove(dst)
+
+            _link(src, dst, hardlink)
+            links.add(rel)
+
+    for rel in owned - links:
+        path = Path(instance, rel)
+        if not (Path(base, rel).exists() and is_writable(rel, writable)):
+            if path.is_symlink() or path.is_file():
+                path.unlink()
+
+    with open(manifest_f, 'w') as f:
+        f.writelines(f'{rel}\n' for rel in sorted(links))
+    return len(links)
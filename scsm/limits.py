@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .disk import set_priority
+
+
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+KEYS = ['cpu_affinity', 'nice', 'ionice', 'rlimits', 'cgroup']
+SIZES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_cpus(cpus):
+    '''Return set of cpus from a list or a string like 0-3,6'''
+    if isinstance(cpus, int):
+        return {cpus}
+    if isinstance(cpus, (list, tuple)):
+        return {int(cpu) for cpu in cpus}
+
+    result = set()
+    for part in str(cpus).split(','):
+        first, _, last = part.strip().partition('-')
+        result.update(range(int(first), int(last or first) + 1))
+    return result
+
+
+def format_cpus(cpus):
+    '''Return set of cpus as a string like 0-3,6'''
+    ranges, cpus = [], sorted(cpus)
+    for cpu in cpus:
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f'{a}-{b}' for a, b in ranges)
+
+
+def parse_size(size):
+    '''Return bytes of a size like 512M or max'''
+    text = str(size).strip().upper()
+    if text in ('MAX', 'UNLIMITED'):
+        return 'max'
+    if text[-1:] in SIZES:
+        return int(float(text[:-1]) * SIZES[text[-1]])
+    return int(text)
+
+
+def cgroup_setup(name, options):
+    '''Create a cgroup v2 group for name with cpu and memory limits
+
+    cpu_max is in percent of one cpu and memory_max a size. Returns the
+    path of the group.
+    '''
+    # a cgroup v1 or hybrid hierarchy has no unified controllers file
+    if not Path(CGROUP_ROOT, 'cgroup.controllers').exists():
+        raise OSError('cgroup v2 is not mounted at ' + str(CGROUP_ROOT))
+
+    base = Path(CGROUP_ROOT, 'scsm')
+    group = Path(base, name)
+    group.mkdir(parents=True, exist_ok=True)
+
+    # controllers have to be enabled in every parent of the group
+    for parent in CGROUP_ROOT, base:
+        try:
+            with open(Path(parent, 'cgroup.subtree_control'), 'w') as f:
+                f.write('+cpu +memory')
+        except OSError:
+            pass
+
+    if 'cpu_max' in options:
+        quota = int(float(options['cpu_max']) * 1000)
+        with open(Path(group, 'cpu.max'), 'w') as f:
+            f.write(f'{quota} 100000')
+    if 'memory_max' in options:
+        with open(Path(group, 'memory.max'), 'w') as f:
+            f.write(str(parse_size(options['memory_max'])))
+    return group
+
+
+def apply(name, limits):
+    '''Apply limits to the current process, they are inherited by its children
+
+    Limits that can not be applied are returned as a list of errors instead
+    of stopping the server from starting.
+    '''
+    errors = []
+
+    if 'cpu_affinity' in limits and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, parse_cpus(limits['cpu_affinity']))
+        except (OSError, ValueError) as e:
+            errors.append(f'cpu_affinity: {e}')
+
+    if 'nice' in limits or 'ionice' in limits:
+        try:
+            if set_priority(int(limits.get('nice', 0)), limits.get('ionice')):
+                errors.append('ionice: failed')
+        except (OSError, KeyError) as e:
+            errors.append(f'priority: {e}')
+
+    for key, value in (limits.get('rlimits') or {}).items():
+        try:
+            limit = getattr(resource, f'RLIMIT_{key.upper()}')
+            values = value if isinstance(value, (list, tuple)) else [value, value]
+            values = [resource.RLIM_INFINITY if str(v) == 'unlimited' else int(v)
+                      for v in values]
+            resource.setrlimit(limit, tuple(values))
+        except (AttributeError, OSError, ValueError) as e:
+            errors.append(f'rlimit {key}: {e}')
+
+    if limits.get('cgroup'):
+        try:
+            group = cgroup_setup(name, limits['cgroup'])
+            with open(Path(group, 'cgroup.procs'), 'w') as f:
+                f.write(str(os.getpid()))
+        except OSError as e:
+            errors.append(f'cgroup: {e}')
+    return errors
+
+
+def current(pid, rlimits=()):
+    '''Return the limits a running process was given
+
+    Only limits that differ from the defaults are returned, cpu_max is in
+    percent of one cpu and memory_max in bytes.
+    '''
+    given = {}
+    if hasattr(os, 'sched_getaffinity'):
+        try:
+            cpus = os.sched_getaffinity(pid)
+            if len(cpus) < os.cpu_count():
+                given['cpu_affinity'] = format_cpus(cpus)
+        except OSError:
+            pass
+
+    try:
+        nice = os.getpriority(os.PRIO_PROCESS, pid)
+        if nice:
+            given['nice'] = nice
+    except (AttributeError, OSError):
+        pass
+
+    if shutil.which('ionice'):
+        result = subprocess.run(['ionice', '-p', str(pid)], capture_output=True, text=True)
+        ionice = result.stdout.split(':')[0].strip()
+        if result.returncode == 0 and ionice not in ('', 'none'):
+            given['ionice'] = ionice
+
+    for key in rlimits:
+        try:
+            soft, hard = resource.prlimit(pid, getattr(resource, f'RLIMIT_{key.upper()}'))
+            given.setdefault('rlimits', {})[key] = [
+                'unlimited' if v == resource.RLIM_INFINITY else v for v in (soft, hard)]
+        except (AttributeError, OSError, ValueError):
+            pass
+
+    try:
+        with open(Path('/proc', str(pid), 'cgroup'), 'r') as f:
+            path = f.read().strip().split('::', 1)[-1]
+        group = Path(CGROUP_ROOT, path.lstrip('/'))
+        cpu_max = Path(group, 'cpu.max')
+        if cpu_max.exists():
+            quota, period = cpu_max.read_text().split()
+            if quota != 'max':
+                given['cpu_max'] = int(quota) * 100 / int(period)
+        memory_max = Path(group, 'memory.max')
+        if memory_max.exists() and memory_max.read_text().strip() != 'max':
+            given['memory_max'] = int(memory_max.read_text())
+    except (OSError, ValueError):
+        pass
+    return given
+
+
+def main():
+    '''Apply limits and run a server command
+
+    Arguments are the state file, the limits as json and the command. The
+    state file records the pid the limits were applied to and any errors.
+    '''
+    state_f, limits, cmd = Path(sys.argv[1]), json.loads(sys.argv[2]), sys.argv[3]
+    errors = apply(state_f.stem, limits)
+    for error in errors:
+        print(f'scsm: {error}', file=sys.stderr)
+
+    state_f.parent.mkdir(parents=True, exist_ok=True)
+    with open(state_f, 'w') as f:
+        json.dump({'pid': os.getpid(), 'limits': limits, 'errors': errors}, f)
+    os.execvp('/bin/sh', ['/bin/sh', '-c', cmd])
+
+
+if __name__ == '__main__':
+    main()
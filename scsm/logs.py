@@ -0,0 +1,306 @@
+import bz2
+import gzip
+import lzma
+import mmap
+import os
+import shutil
+import sys
+import threading
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import sleep, time
+
+from .config import Config
+
+
+CODECS = {'bz2': bz2, 'gz': gzip, 'xz': lzma}
+CURRENT = 'current.log'
+CURRENT_INDEX = 'current.idx'
+LOG_DATE = '%Y-%m-%d-%H%M%S-%f'
+
+
+def parse_since(text):
+    '''Return timestamp of an age like 90s, 30m, 2h or 1d or a date and time'''
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if text[-1:] in units and text[:-1].replace('.', '', 1).isdigit():
+        return time() - float(text[:-1]) * units[text[-1]]
+    return datetime.fromisoformat(text).timestamp()
+
+
+def segments(log_dir):
+    '''Return rotated log segments in log_dir, oldest first'''
+    files = [f for f in Path(log_dir).glob('*.log*')
+             if f.name != CURRENT and not f.name.endswith('.tmp')]
+    return sorted(files, key=lambda f: f.name)
+
+
+def index_f(f):
+    '''Return time index file of a log segment'''
+    if f.name == CURRENT:
+        return Path(f.parent, CURRENT_INDEX)
+    return Path(f.parent, f'{f.name.split(".")[0]}.idx')
+
+
+def open_segment(f):
+    '''Return binary file object of a log segment, decompressing archives'''
+    codec = CODECS.get(f.suffix.lstrip('.'))
+    return codec.open(f, 'rb') if codec else open(f, 'rb')
+
+
+def seek_offset(f, since):
+    '''Return uncompressed offset of the first output at or after since
+
+    Returns None if the segment ended before since. The index holds one
+    entry of time and offset for every second output was written in.
+    '''
+    if f.name != CURRENT:
+        # segments are named after the time they were closed
+        if datetime.strptime(f.name.split('.')[0], LOG_DATE).timestamp() < since:
+            return None
+
+    try:
+        with open(index_f(f), 'r') as idx:
+            entries = [[int(i) for i in line.split()] for line in idx if line.strip()]
+    except (OSError, ValueError):
+        return 0
+
+    times = [entry[0] for entry in entries]
+    i = bisect_left(times, int(since))
+    if i == len(entries):
+        return None if f.name != CURRENT else Path(f).stat().st_size
+    return entries[i][1]
+
+
+def read(log_dir, since=None, pattern=None):
+    '''Yield lines of all segments and the current log oldest first
+
+    With since only output written at or after the timestamp since is read,
+    segments that ended earlier are skipped and the rest seek straight to
+    the offset found in their time index. With pattern only lines matching
+    the compiled bytes regex are returned.
+    '''
+    for f in [*segments(log_dir), Path(log_dir, CURRENT)]:
+        offset = 0
+        if since:
+            offset = seek_offset(f, since)
+            if offset is None:
+                continue
+
+        try:
+            fp = open_segment(f)
+        except OSError:
+            continue
+
+        with fp:
+            if offset:
+                # offsets are at write boundaries, skip a partial first line
+                fp.seek(offset - 1)
+                if fp.read(1) != b'\n':
+                    fp.readline()
+
+            for line in fp:
+                line = line.rstrip(b'\r\n')
+                if pattern is None or pattern.search(line):
+                    yield line
+
+
+def tail(log_dir, lines=10, pattern=None):
+    '''Return the last lines of the log, newest segments first
+
+    Uncompressed logs are memory mapped and read backwards from the end so
+    only the tail of a large log is touched. Archived segments are streamed
+    and only read if the newer ones do not have enough lines.
+    '''
+    result = []
+    for f in reversed([*segments(log_dir), Path(log_dir, CURRENT)]):
+        needed = lines - len(result)
+        if needed <= 0:
+            break
+
+        try:
+            size = f.stat().st_size
+        except OSError:
+            continue
+
+        if f.suffix != '.log':
+            with open_segment(f) as fp:
+                stripped = (line.rstrip(b'\r\n') for line in fp)
+                found = deque((line for line in stripped
+                               if pattern is None or pattern.search(line)), maxlen=needed)
+        elif size:
+            found = deque()
+            with open(f, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                end = size - 1 if m[size - 1:size] == b'\n' else size
+                while end > 0 and len(found) < needed:
+                    start = m.rfind(b'\n', 0, end) + 1
+                    line = m[start:end].rstrip(b'\r')
+                    if pattern is None or pattern.search(line):
+                        found.appendleft(line)
+                    end = start - 1
+        else:
+            continue
+        result = [*found, *result]
+    return result
+
+
+def follow(log_dir, pattern=None, interval=0.25):
+    '''Yield lines written to the current log from now on, across rotations'''
+    f = Path(log_dir, CURRENT)
+    while not f.exists():
+        sleep(interval)
+
+    fp = open(f, 'rb')
+    fp.seek(0, os.SEEK_END)
+    partial = b''
+
+    try:
+        while True:
+            data = fp.read()
+            if data:
+                *found, partial = (partial + data).split(b'\n')
+                for line in found:
+                    line = line.rstrip(b'\r')
+                    if pattern is None or pattern.search(line):
+                        yield line
+                continue
+
+            # rotation renames the log and starts a new one
+            try:
+                rotated = os.stat(f).st_ino != os.fstat(fp.fileno()).st_ino
+            except FileNotFoundError:
+                rotated = False
+
+            if rotated:
+                fp.close()
+                fp = open(f, 'rb')
+            else:
+                sleep(interval)
+    finally:
+        fp.close()
+
+
+class LogWriter():
+    '''Server output log rotated by size and age
+
+    Output is appended to current.log in log_dir. Rotated segments are named
+    after the time they were closed and compressed by a background thread,
+    then the oldest segments are removed while the directory is larger than
+    max_total. Sizes are in MiB and max_age is in hours.
+    '''
+    def __init__(self, log_dir, max_size=10, max_age=24, max_total=100, compression='gz'):
+        self.log_dir = Path(log_dir)
+        self.max_size = max_size * 1024 * 1024
+        self.max_age = max_age * 3600
+        self.max_total = max_total * 1024 * 1024
+        self.compression = compression or ''
+        self.current_f = Path(log_dir, CURRENT)
+        self.index_f = Path(log_dir, CURRENT_INDEX)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.f = None
+        self.index = None
+
+        # every boot starts a new segment
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.rotate()
+
+    @staticmethod
+    def from_config(log_dir):
+        '''Return LogWriter using the log settings from the config'''
+        return LogWriter(log_dir, Config.log_max_size, Config.log_max_age,
+                         Config.log_max_total, Config.log_compression)
+
+    def write(self, data):
+        '''Append data and rotate once the segment is too large or old'''
+        now = int(time())
+        if now != self.indexed:
+            self.index.write(f'{now} {self.size}\n')
+            self.index.flush()
+            self.indexed = now
+
+        self.f.write(data)
+        self.f.flush()
+        self.size += len(data)
+
+        if self.size >= self.max_size or time() - self.started >= self.max_age:
+            self.rotate()
+
+    def rotate(self):
+        '''Close the current segment and compress it in the background'''
+        if self.f:
+            self.f.close()
+            self.index.close()
+
+        if self.current_f.exists() and self.current_f.stat().st_size:
+            date = datetime.fromtimestamp(self.current_f.stat().st_mtime)
+            while True:
+                dst = Path(self.log_dir, f'{date.strftime(LOG_DATE)}.log')
+                if not any(f.name.startswith(dst.name) for f in segments(self.log_dir)):
+                    break
+                date += timedelta(microseconds=1)
+            self.current_f.rename(dst)
+            if self.index_f.exists():
+                self.index_f.rename(index_f(dst))
+
+        self.f = open(self.current_f, 'ab')
+        self.index = open(self.index_f, 'w')
+        self.started = time()
+        self.indexed = None
+        self.size = 0
+
+        self.threads = [t for t in self.threads if t.is_alive()]
+        thread = threading.Thread(target=self.compress)
+        thread.start()
+        self.threads.append(thread)
+
+    def compress(self):
+        '''Compress rotated segments and remove the oldest over max_total'''
+        with self.lock:
+            for src in segments(self.log_dir):
+                if not self.compression or src.suffix != '.log':
+                    continue
+
+                dst = Path(f'{src}.{self.compression}')
+                tmp = Path(f'{dst}.tmp')
+                with open(src, 'rb') as fsrc, CODECS[self.compression].open(tmp, 'wb') as fdst:
+                    shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+                shutil.copystat(src, tmp)
+                tmp.rename(dst)
+                src.unlink()
+            self.prune()
+
+    def prune(self):
+        '''Remove the oldest segments while over max_total'''
+        files = segments(self.log_dir)
+        total = sum(f.stat().st_size for f in [*files, self.current_f] if f.exists())
+
+        while files and total > self.max_total:
+            f = files.pop(0)
+            total -= f.stat().st_size
+            f.unlink()
+            if index_f(f).exists():
+                index_f(f).unlink()
+
+    def close(self):
+        '''Close the current segment and wait for compression to finish'''
+        self.f.close()
+        self.index.close()
+        for thread in self.threads:
+            thread.join()
+
+
+def main():
+    '''Write stdin to the log in sys.argv[1], used with tmux pipe-pane'''
+    writer = LogWriter.from_config(sys.argv[1])
+    try:
+        # large reads keep the overhead low for chatty servers
+        while data := os.read(sys.stdin.fileno(), 65536):
+            writer.write(data)
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from . import proc
+from .config import Config
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+METRICS = {
+    'scsm_server_up': ('gauge', 'Whether the server process is running'),
+    'scsm_server_start_time_seconds': ('gauge', 'Unix time the server was started'),
+    'scsm_server_cpu_seconds_total': ('counter', 'CPU time used by the server process tree'),
+    'scsm_server_memory_bytes': ('gauge', 'Resident memory of the server process tree'),
+    'scsm_server_processes': ('gauge', 'Number of processes in the server process tree'),
+    'scsm_server_threads': ('gauge', 'Number of threads in the server process tree'),
+    'scsm_server_open_files': ('gauge', 'Number of files open by the server process tree'),
+    'scsm_server_read_bytes_total': ('counter', 'Bytes read from disk by the server'),
+    'scsm_server_write_bytes_total': ('counter', 'Bytes written to disk by the server'),
+    'scsm_monitor_restarts_total': ('counter', 'Servers restarted by scsm monitor'),
+    'scsm_watchdog_hangs_total': ('counter', 'Hung servers found by the monitor watchdog'),
+    'scsm_backup_duration_seconds': ('gauge', 'Duration of the last backup'),
+    'scsm_backup_size_bytes': ('gauge', 'Size of the last backup'),
+    'scsm_backup_last_success_timestamp_seconds': ('gauge', 'Unix time of the last backup'),
+    'scsm_update_duration_seconds': ('gauge', 'Duration of the last update'),
+    'scsm_update_last_success_timestamp_seconds': ('gauge', 'Unix time of the last update'),
+    'scsm_update_failures_total': ('counter', 'Failed updates'),
+}
+
+
+def metrics_f():
+    return Path(Config.state_dir, 'metrics.json')
+
+
+def pids_dir():
+    return Path(Config.state_dir, 'pids')
+
+
+def load():
+    '''Return stored operation metrics'''
+    try:
+        with open(metrics_f(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def lock(f):
+    '''Lock the open file f until it is closed'''
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_EX)
+    else:
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def record(name, value, increment=False, **labels):
+    '''Store an operation metric, adding to its value if increment is True
+
+    Metrics are kept in a json file in state_dir so every scsm process can
+    record them and the exporter only has to read a single file.
+    '''
+    f = metrics_f()
+    f.parent.mkdir(parents=True, exist_ok=True)
+    key = json.dumps([name, labels], sort_keys=True)
+
+    with open(Path(f.parent, 'metrics.lock'), 'w') as lock_f:
+        lock(lock_f)
+        data = load()
+        if increment:
+            value += data.get(key, 0)
+        data[key] = value
+
+        tmp = Path(f'{f}.tmp')
+        with open(tmp, 'w') as fdst:
+            json.dump(data, fdst)
+        tmp.replace(f)
+
+
+def record_start(session_name, app_name, server_name, pid):
+    '''Record the pid of a started server so it can be checked without tmux'''
+    pids_dir().mkdir(parents=True, exist_ok=True)
+    with open(Path(pids_dir(), f'{session_name}.json'), 'w') as f:
+        json.dump({'app': app_name, 'server': server_name, 'pid': pid,
+                   'start_time': proc.start_time(pid)}, f)
+
+
+def collect():
+    '''Return list of name, labels and value of every metric
+
+    Servers are checked through the pids recorded when they were started
+    and their /proc entries, so collecting never runs tmux.
+    '''
+    samples = []
+    for f in sorted(pids_dir().glob('*.json')):
+        try:
+            with open(f, 'r') as fsrc:
+                data = json.load(fsrc)
+        except (OSError, ValueError):
+            continue
+
+        labels = {'app': data['app'], 'server': data['server']}
+        # a different start time means the pid has been reused
+        up = data['pid'] and proc.start_time(data['pid']) == data['start_time']
+        samples.append(('scsm_server_up', labels, int(bool(up))))
+        if not up:
+            continue
+
+        usage = proc.usage(data['pid'])
+        samples.extend([
+            ('scsm_server_start_time_seconds', labels, proc.timestamp(data['start_time'])),
+            ('scsm_server_cpu_seconds_total', labels, usage['cpu']),
+            ('scsm_server_memory_bytes', labels, usage['rss']),
+            ('scsm_server_processes', labels, usage['processes']),
+            ('scsm_server_threads', labels, usage['threads']),
+            ('scsm_server_open_files', labels, usage['files']),
+            ('scsm_server_read_bytes_total', labels, usage['read_bytes']),
+            ('scsm_server_write_bytes_total', labels, usage['write_bytes']),
+        ])
+
+    for key, value in sorted(load().items()):
+        name, labels = json.loads(key)
+        samples.append((name, labels, value))
+    return samples
+
+
+def render(samples=None):
+    '''Return metrics in the Prometheus text exposition format'''
+    if samples is None:
+        samples = collect()
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    lines = []
+    for name, (kind, text) in METRICS.items():
+        found = [sample for sample in samples if sample[0] == name]
+        if not found:
+            continue
+
+        lines.append(f'# HELP {name} {text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for _, labels, value in found:
+            label = ','.join(f'{k}="{escape(v)}"' for k, v in sorted(labels.items()))
+            lines.append(f'{name}{{{label}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    '''Write metrics for the node exporter textfile collector'''
+    tmp = Path(f'{path}.tmp')
+    with open(tmp, 'w') as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=9633):
+    '''Serve metrics on http://host:port/metrics until interrupted'''
+    with ThreadingHTTPServer((host, port), MetricsHandler) as httpd:
+        httpd.serve_forever()
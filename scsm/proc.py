@@ -0,0 +1,136 @@
+import os
+from pathlib import Path
+from time import monotonic
+
+
+PROC = Path('/proc')
+
+if hasattr(os, 'sysconf'):
+    CLK_TCK = os.sysconf('SC_CLK_TCK')
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+else:
+    CLK_TCK, PAGE_SIZE = 100, 4096
+
+# kernels built with CONFIG_PROC_CHILDREN list the children of every task
+CHILDREN_FILES = Path(PROC, 'thread-self', 'children').exists()
+
+
+def children(pid):
+    '''Return pid and the pids of all its descendants'''
+    # the children files only need the process tree itself to be read
+    if CHILDREN_FILES:
+        pids, queue = [], [int(pid)]
+        while queue:
+            pid = queue.pop(0)
+            pids.append(pid)
+            try:
+                for task in os.listdir(Path(PROC, str(pid), 'task')):
+                    with open(Path(PROC, str(pid), 'task', task, 'children'), 'r') as f:
+                        queue.extend(int(i) for i in f.read().split())
+            except OSError:
+                continue
+        return pids
+
+    parents = {}
+    for d in PROC.iterdir():
+        if d.name.isdigit():
+            try:
+                with open(Path(d, 'stat'), 'r') as f:
+                    # the command name can contain spaces, fields follow the last )
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            parents.setdefault(ppid, []).append(int(d.name))
+
+    pids, queue = [], [int(pid)]
+    while queue:
+        pid = queue.pop(0)
+        pids.append(pid)
+        queue.extend(parents.get(pid, []))
+    return pids
+
+
+def open_files(pid):
+    '''Return paths of regular files pid has open'''
+    files = []
+    try:
+        fds = os.listdir(Path(PROC, str(pid), 'fd'))
+    except OSError:
+        return files
+
+    for fd in fds:
+        try:
+            path = os.readlink(Path(PROC, str(pid), 'fd', fd))
+        except OSError:
+            continue
+        if path.startswith('/') and not path.startswith(('/dev/', '/proc/')):
+            files.append(path)
+    return files
+
+
+def start_time(pid):
+    '''Return start time of pid in clock ticks since boot or None'''
+    try:
+        with open(Path(PROC, str(pid), 'stat'), 'r') as f:
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def timestamp(ticks):
+    '''Return unix time of clock ticks since boot'''
+    with open(Path(PROC, 'stat'), 'r') as f:
+        for line in f:
+            if line.startswith('btime'):
+                return int(line.split()[1]) + ticks / CLK_TCK
+    return None
+
+
+def usage(pid):
+    '''Return resource usage totals of pid and all its descendants
+
+    CPU time, threads and resident memory come from stat, disk I/O from io
+    and open files are counted in fd. Files that can not be read, like io of
+    processes owned by other users, are left out of the totals.
+    '''
+    total = {'time': monotonic(), 'processes': 0, 'cpu': 0.0, 'threads': 0, 'rss': 0,
+             'files': 0, 'read_bytes': 0, 'write_bytes': 0}
+
+    for pid in children(pid):
+        try:
+            with open(Path(PROC, str(pid), 'stat'), 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+
+        # fields after the command name start at field 3, state
+        total['processes'] += 1
+        total['cpu'] += (int(fields[11]) + int(fields[12])) / CLK_TCK
+        total['threads'] += int(fields[17])
+        total['rss'] += int(fields[21]) * PAGE_SIZE
+
+        try:
+            with open(Path(PROC, str(pid), 'io'), 'r') as f:
+                for line in f:
+                    key, value = line.split(':')
+                    if key in ('read_bytes', 'write_bytes'):
+                        total[key] += int(value)
+        except (OSError, ValueError):
+            pass
+
+        try:
+            total['files'] += len(os.listdir(Path(PROC, str(pid), 'fd')))
+        except OSError:
+            pass
+    return total
+
+
+def rates(first, last):
+    '''Return CPU percent and disk read and write bytes per second between samples'''
+    elapsed = last['time'] - first['time']
+    if elapsed <= 0:
+        return {'cpu_percent': 0.0, 'read_rate': 0.0, 'write_rate': 0.0}
+
+    return {'cpu_percent': max(last['cpu'] - first['cpu'], 0) / elapsed * 100,
+            'read_rate': max(last['read_bytes'] - first['read_bytes'], 0) / elapsed,
+            'write_rate': max(last['write_bytes'] - first['write_bytes'], 0) / elapsed}
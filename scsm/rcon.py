@@ -0,0 +1,123 @@
+import socket
+import struct
+import threading
+
+
+SERVERDATA_AUTH = 3
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_RESPONSE_VALUE = 0
+
+# open connections shared by every Server in the process
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+class RCONError(Exception):
+    pass
+
+
+class RCON():
+    '''Source RCON client
+
+    Responses split over several packets are collected by sending an empty
+    response packet after the command, which the server mirrors once the
+    command's output is complete.
+    '''
+    def __init__(self, host, port, password, timeout=5):
+        self.host = host
+        self.port = int(port)
+        self.password = password
+        self.timeout = timeout
+        self.sock = None
+        self.request_id = 0
+        self.lock = threading.Lock()
+
+    def _send(self, kind, body):
+        self.request_id += 1
+        data = struct.pack('<ii', self.request_id, kind) + body.encode() + b'\x00\x00'
+        self.sock.sendall(struct.pack('<i', len(data)) + data)
+        return self.request_id
+
+    def _recv_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Connection closed by server')
+            data += chunk
+        return data
+
+    def _recv(self):
+        size = struct.unpack('<i', self._recv_exact(4))[0]
+        data = self._recv_exact(size)
+        request_id, kind = struct.unpack_from('<ii', data)
+        return request_id, kind, data[8:-2].decode(errors='replace')
+
+    def connect(self):
+        '''Connect and authenticate'''
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.settimeout(self.timeout)
+        try:
+            request_id = self._send(SERVERDATA_AUTH, self.password)
+            while True:
+                response_id, kind, _ = self._recv()
+                # an empty response value comes before the auth response
+                if kind == SERVERDATA_AUTH_RESPONSE:
+                    break
+        except OSError:
+            self.close()
+            raise
+
+        if response_id != request_id:
+            self.close()
+            raise RCONError('Authentication failed')
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def command(self, command, expect_close=False):
+        '''Run command and return its output
+
+        With expect_close the server closing a new connection, like it does
+        after quit, is taken as the command being acknowledged. A pooled
+        connection closing may just be stale, so the command is retried.
+        '''
+        with self.lock:
+            for attempt in range(2):
+                fresh = self.sock is None
+                if fresh:
+                    self.connect()
+
+                try:
+                    return self._command(command)
+                except OSError as e:
+                    self.close()
+                    if fresh and expect_close and isinstance(e, ConnectionError):
+                        return ''
+                    # a pooled connection may have gone stale, retry once
+                    if fresh or attempt == 1:
+                        raise
+
+    def _command(self, command):
+        request_id = self._send(SERVERDATA_EXECCOMMAND, command)
+        end_id = self._send(SERVERDATA_RESPONSE_VALUE, '')
+
+        output = []
+        while True:
+            response_id, kind, body = self._recv()
+            if response_id == end_id:
+                return ''.join(output)
+            if response_id == request_id:
+                output.append(body)
+
+
+def connection(host, port, password, timeout=5):
+    '''Return the pooled connection of a server, creating it if needed'''
+    key = (host, int(port), password)
+    with _pool_lock:
+        if key not in _pool:
+            _pool[key] = RCON(host, port, password, timeout)
+        return _pool[key]
@@ -0,0 +1,178 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+from time import sleep
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    boto3 = None
+
+# S3 requires every part except the last to be at least 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class S3Storage():
+    '''Streaming backup storage on S3 compatible object storage'''
+    def __init__(self, bucket, prefix='', endpoint_url=None, access_key=None,
+                 secret_key=None, region=None, workers=4, part_size=16, retries=5):
+        if boto3 is None:
+            raise ImportError('boto3 is required for S3 storage, install scsm[s3]')
+
+        self.bucket = bucket
+        self.prefix = prefix or ''
+        self.workers = workers
+        self.part_size = max(int(part_size * 1024 * 1024), MIN_PART_SIZE)
+        self.retries = retries
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None,
+                                   aws_access_key_id=access_key or None,
+                                   aws_secret_access_key=secret_key or None,
+                                   region_name=region or None,
+                                   config=BotoConfig(retries={'max_attempts': retries,
+                                                              'mode': 'standard'},
+                                                     max_pool_connections=workers + 1))
+
+    def key(self, path):
+        '''Return object key for path relative to prefix'''
+        return str(PurePosixPath(self.prefix, str(path)))
+
+    def delete(self, path):
+        '''Delete object'''
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(path))
+
+    def size(self, path):
+        '''Return size of object in bytes'''
+        return self.client.head_object(Bucket=self.bucket, Key=self.key(path))['ContentLength']
+
+    def list(self, path):
+        '''Return sorted object names directly under path'''
+        prefix = f'{self.key(path)}/'
+        names = []
+
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            for obj in page.get('Contents', []):
+                names.append(obj['Key'][len(prefix):])
+        return sorted(names)
+
+    def open(self, path, mode='rb'):
+        '''Return a streaming file object for reading or writing an object'''
+        if mode == 'rb':
+            return S3Reader(self, self.key(path))
+        elif mode == 'wb':
+            return S3Writer(self, self.key(path))
+        raise ValueError(f'Invalid mode {mode}')
+
+
+class S3Reader():
+    '''Readable file object that resumes with a range request on errors'''
+    def __init__(self, storage, key):
+        self.storage = storage
+        self.key = key
+        self.offset = 0
+        self.body = None
+
+    def read(self, size=-1):
+        # requests are retried by botocore, only a broken stream is resumed here
+        for attempt in range(self.storage.retries):
+            if self.body is None:
+                try:
+                    self.body = self.storage.client.get_object(
+                        Bucket=self.storage.bucket, Key=self.key,
+                        Range=f'bytes={self.offset}-')['Body']
+                except ClientError as e:
+                    # reading past the end of the object
+                    if e.response['Error']['Code'] == 'InvalidRange':
+                        return b''
+                    raise
+            try:
+                data = self.body.read(None if size < 0 else size)
+                self.offset += len(data)
+                return data
+            except BotoCoreError as e:
+                error = e
+            self.body = None
+            sleep(2 ** attempt / 10)
+        raise error
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class S3Writer():
+    '''Writable file object streaming to a multipart upload
+
+    Parts are uploaded in parallel and at most two parts per worker are held
+    in memory at once.
+    '''
+    def __init__(self, storage, key):
+        self.storage = storage
+        self.client = storage.client
+        self.key = key
+        self.buffer = bytearray()
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=storage.workers)
+        self.slots = threading.BoundedSemaphore(storage.workers * 2)
+        self.upload_id = self.client.create_multipart_upload(
+            Bucket=storage.bucket, Key=key)['UploadId']
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.storage.part_size:
+            self._submit(bytes(self.buffer[:self.storage.part_size]))
+            del self.buffer[:self.storage.part_size]
+        return len(data)
+
+    def _submit(self, data):
+        self.slots.acquire()
+        future = self.executor.submit(self._upload, len(self.futures) + 1, data)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def _upload(self, number, data):
+        # failed requests are retried by botocore
+        response = self.client.upload_part(Bucket=self.storage.bucket, Key=self.key,
+                                           UploadId=self.upload_id,
+                                           PartNumber=number, Body=data)
+        return {'ETag': response['ETag'], 'PartNumber': number}
+
+    def abort(self):
+        '''Abort the upload and discard uploaded parts'''
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.client.abort_multipart_upload(Bucket=self.storage.bucket, Key=self.key,
+                                           UploadId=self.upload_id)
+
+    def close(self):
+        '''Upload remaining data and complete the upload'''
+        if self.buffer or not self.futures:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+
+        try:
+            parts = [future.result() for future in self.futures]
+        except Exception:
+            self.abort()
+            raise
+
+        self.executor.shutdown()
+        self.client.complete_multipart_upload(Bucket=self.storage.bucket, Key=self.key,
+                                              UploadId=self.upload_id,
+                                              MultipartUpload={'Parts': parts})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
@@ -0,0 +1,348 @@
+import json
+import os
+import select
+import selectors
+import signal
+import socket
+import struct
+import subprocess
+import sys
+from collections import deque
+from pathlib import Path
+from time import monotonic, sleep
+
+try:
+    import fcntl
+    import pty
+    import termios
+    import tty
+except ImportError:
+    # windows has no ptys, servers can only run there without scsm
+    fcntl = pty = termios = tty = None
+
+from . import proc
+from .logs import LogWriter
+
+
+# lines of output kept for capture and replayed when attaching
+BUFFER_LINES = 10000
+# ctrl-] detaches from the console like telnet
+DETACH_KEY = b'\x1d'
+
+
+class Supervisor():
+    '''Run a server under a pty and serve its console on a unix socket
+
+    Output is kept in a bounded ring buffer of lines. Clients connect to the
+    socket and send a single json request: send a command, capture output by
+    absolute line index or attach to the console. With log_dir all output is
+    also written to a rotated log.
+    '''
+    def __init__(self, name, run_dir, cwd, cmd, log_dir=None, lines=BUFFER_LINES):
+        self.name = name
+        self.run_dir = Path(run_dir)
+        self.cwd = cwd
+        self.cmd = cmd
+        self.lines = deque(maxlen=lines)
+        self.count = 0
+        self.partial = b''
+        self.clients = []
+        self.pid = None
+        self.fd = None
+        self.log_dir = log_dir
+        self.log = None
+
+    @property
+    def pid_f(self):
+        return Path(self.run_dir, f'{self.name}.pid')
+
+    @property
+    def sock_f(self):
+        return Path(self.run_dir, f'{self.name}.sock')
+
+    def capture(self, start=0):
+        '''Return lines from absolute index start and the next line index'''
+        first = self.count - len(self.lines)
+        lines = [*self.lines][max(start - first, 0):]
+        if self.partial:
+            lines.append(self.partial.decode(errors='replace'))
+        return lines, self.count
+
+    def output(self, data):
+        '''Add output to the line buffer and forward it to attached clients'''
+        if self.log:
+            self.log.write(data)
+
+        for client in [*self.clients]:
+            try:
+                client.sendall(data)
+            except OSError:
+                self.detach(client)
+
+        *lines, self.partial = (self.partial + data).split(b'\n')
+        for line in lines:
+            self.lines.append(line.rstrip(b'\r').decode(errors='replace'))
+            self.count += 1
+
+    def detach(self, client):
+        '''Stop forwarding output to client'''
+        self.clients.remove(client)
+        self.selector.unregister(client)
+        client.close()
+
+    def request(self, conn):
+        '''Handle a single client request'''
+        conn.settimeout(1)
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+
+        try:
+            request = json.loads(data)
+        except ValueError:
+            conn.close()
+            return
+
+        if request['cmd'] == 'send':
+            os.write(self.fd, request['data'].encode())
+            conn.sendall(b'{}\n')
+        elif request['cmd'] == 'position':
+            conn.sendall(json.dumps({'end': self.count}).encode() + b'\n')
+        elif request['cmd'] == 'capture':
+            lines, end = self.capture(request.get('start', 0))
+            conn.sendall(json.dumps({'lines': lines, 'end': end}).encode() + b'\n')
+        elif request['cmd'] == 'attach':
+            if 'rows' in request:
+                size = struct.pack('HHHH', request['rows'], request['cols'], 0, 0)
+                fcntl.ioctl(self.fd, termios.TIOCSWINSZ, size)
+            conn.setblocking(False)
+            # replay recent output so the console is not empty
+            lines, _ = self.capture(max(self.count - 100, 0))
+            conn.sendall('\r\n'.join(lines).encode())
+            self.clients.append(conn)
+            self.selector.register(conn, selectors.EVENT_READ, 'client')
+            return
+        conn.close()
+
+    def run(self):
+        '''Start the server and supervise it until it exits'''
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        if self.sock_f.exists():
+            self.sock_f.unlink()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(self.sock_f))
+        server.listen()
+
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            # the child must never return into the supervisor's code
+            try:
+                os.chdir(self.cwd)
+                os.execvp('/bin/sh', ['/bin/sh', '-c', self.cmd])
+            except OSError as e:
+                os.write(2, f'scsm: {e}\n'.encode())
+            finally:
+                os._exit(127)
+
+        for sig in signal.SIGTERM, signal.SIGHUP, signal.SIGINT:
+            signal.signal(sig, lambda signum, frame: os.killpg(self.pid, signum))
+
+        tmp = Path(f'{self.pid_f}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'pid': self.pid, 'supervisor': os.getpid(),
+                       'start_time': proc.start_time(self.pid)}, f)
+        tmp.replace(self.pid_f)
+
+        if self.log_dir:
+            self.log = LogWriter.from_config(self.log_dir)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.fd, selectors.EVENT_READ, 'pty')
+        self.selector.register(server, selectors.EVENT_READ, 'server')
+
+        try:
+            while True:
+                for key, _ in self.selector.select():
+                    if key.data == 'pty':
+                        try:
+                            data = os.read(self.fd, 65536)
+                        except OSError:
+                            data = b''
+                        if not data:
+                            return os.waitstatus_to_exitcode(os.waitpid(self.pid, 0)[1])
+                        self.output(data)
+                    elif key.data == 'server':
+                        conn, _ = server.accept()
+                        try:
+                            self.request(conn)
+                        except OSError:
+                            conn.close()
+                    else:
+                        try:
+                            data = key.fileobj.recv(65536)
+                        except OSError:
+                            data = b''
+                        if data:
+                            os.write(self.fd, data)
+                        else:
+                            self.detach(key.fileobj)
+        finally:
+            for client in [*self.clients]:
+                self.detach(client)
+            server.close()
+            if self.log:
+                self.log.close()
+            for f in self.sock_f, self.pid_f:
+                if f.exists():
+                    f.unlink()
+
+
+class SupervisorBackend():
+    '''Execution backend running servers under scsm's own pty supervisor'''
+    def __init__(self, name, run_dir):
+        self.name = name
+        self.run_dir = Path(run_dir)
+        self.pid_f = Path(run_dir, f'{name}.pid')
+        self.sock_f = Path(run_dir, f'{name}.sock')
+
+    @staticmethod
+    def read_pid(pid_f):
+        '''Return pid from a pid file if that process is still the server or None'''
+        try:
+            with open(pid_f, 'r') as f:
+                data = json.load(f)
+            pid = data['pid']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # a stale pid file may name an unrelated process that reused the pid
+        started = data.get('start_time')
+        if started is not None and proc.start_time(pid) != started:
+            return None
+        return pid
+
+    @property
+    def pid(self):
+        '''Return pid of the server process or None'''
+        return SupervisorBackend.read_pid(self.pid_f)
+
+    @property
+    def running(self):
+        '''Return True if the server process is alive'''
+        return SupervisorBackend.alive(self.pid)
+
+    @staticmethod
+    def alive(pid):
+        '''Return True if process pid exists'''
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def sessions(run_dir):
+        '''Return set of names of running supervised servers'''
+        names = set()
+        if not Path(run_dir).exists():
+            return names
+
+        for f in Path(run_dir).glob('*.pid'):
+            if SupervisorBackend.alive(SupervisorBackend.read_pid(f)):
+                names.add(f.stem)
+        return names
+
+    def request(self, **request):
+        '''Send a request to the supervisor and return its reply'''
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            sock.connect(str(self.sock_f))
+            sock.sendall(json.dumps(request).encode() + b'\n')
+
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        return json.loads(data) if data else {}
+
+    def capture(self, start=0):
+        '''Return output lines from absolute line start and the next line index'''
+        reply = self.request(cmd='capture', start=start)
+        return reply.get('lines', []), reply.get('end', start)
+
+    def position(self):
+        '''Return absolute index of the line being written'''
+        return self.request(cmd='position').get('end', 0)
+
+    def console(self):
+        '''Attach the terminal to the server console until ctrl-] is pressed'''
+        rows, cols = os.get_terminal_size()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(self.sock_f))
+            sock.sendall(json.dumps({'cmd': 'attach', 'rows': rows,
+                                     'cols': cols}).encode() + b'\n')
+
+            stdin = sys.stdin.fileno()
+            old = termios.tcgetattr(stdin)
+            tty.setraw(stdin)
+            try:
+                while True:
+                    readable, _, _ = select.select([stdin, sock], [], [])
+                    if stdin in readable:
+                        data = os.read(stdin, 1024)
+                        if DETACH_KEY in data:
+                            break
+                        sock.sendall(data)
+                    if sock in readable:
+                        data = sock.recv(65536)
+                        if not data:
+                            break
+                        os.write(sys.stdout.fileno(), data)
+            finally:
+                termios.tcsetattr(stdin, termios.TCSADRAIN, old)
+
+    def kill(self):
+        '''Kill the server process group'''
+        pid = self.pid
+        if SupervisorBackend.alive(pid):
+            os.killpg(pid, signal.SIGKILL)
+
+    def send(self, command):
+        '''Send command to the server console'''
+        # c-c is the tmux key name used to stop servers without stop commands
+        data = '\x03' if command.lower() == 'c-c' else f'{command}\r'
+        self.request(cmd='send', data=data)
+
+    def start(self, cmd, cwd, debug=False, log_dir=None):
+        '''Start cmd under a detached supervisor process, logging to log_dir'''
+        if debug:
+            # keep a shell open after the server exits like the tmux backend
+            cmd = f'{cmd}; exec /bin/sh'
+
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        args = [sys.executable, '-m', 'scsm.supervisor', self.name,
+                str(self.run_dir), str(cwd), cmd]
+        if log_dir:
+            args.append(str(log_dir))
+        subprocess.Popen(args,
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+
+        # wait for the supervisor so running is accurate once start returns
+        deadline = monotonic() + 5
+        while monotonic() < deadline and not (self.running and self.sock_f.exists()):
+            sleep(0.01)
+
+
+if __name__ == '__main__':
+    sys.exit(Supervisor(*sys.argv[1:6]).run())
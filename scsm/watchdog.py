@@ -0,0 +1,111 @@
+from datetime import datetime
+from pathlib import Path
+from time import monotonic
+
+from . import logs
+from .config import Config
+
+
+DEFAULTS = {'action': 'restart', 'cpu_timeout': 0, 'grace': 300, 'output_timeout': 0,
+            'query_timeout': 0, 'require': 'all'}
+INCIDENT_DATE = '%Y-%m-%d-%H%M%S'
+# lines of output recorded with an incident
+INCIDENT_LINES = 100
+
+
+class Watchdog():
+    '''Detect a server that is running but hung
+
+    Checks are enabled per server in the watchdog options of the app config
+    by giving them a timeout in seconds: no reply to A2S queries, no new
+    output and CPU use stuck at idle or at one full core. With require all,
+    the default, every enabled check has to fail before the server is taken
+    to be hung, with any a single one is enough. Nothing is checked until
+    grace seconds after the server was first seen.
+    '''
+    def __init__(self, server):
+        self.server = server
+        self.options = {**DEFAULTS, **server.watchdog_options}
+        self.seen = self.output_at = self.query_at = monotonic()
+        self.output = None
+        self.cpu_at = None
+        self.cpu = 0.0
+
+    def output_position(self):
+        '''Return a value that changes whenever the server prints output'''
+        # the log size is a stat, the console position needs the backend
+        log_f = Path(self.server.log_dir, logs.CURRENT)
+        if Config.log_enabled and log_f.exists():
+            return log_f.stat().st_size
+        try:
+            return self.server.backend.position()
+        except (AttributeError, IndexError, OSError, ValueError):
+            return None
+
+    def check(self, reply=None):
+        '''Update the checks and return reasons the server is hung, if it is
+
+        reply is the server's latest A2S reply or None if it did not answer.
+        '''
+        now = monotonic()
+        options = self.options
+
+        output = self.output_position()
+        if output != self.output:
+            self.output, self.output_at = output, now
+
+        if reply is not None:
+            self.query_at = now
+
+        usage = self.server.sample()
+        if usage and len(self.server.samples) > 1:
+            self.cpu = usage['cpu_percent']
+            if self.cpu < 1 or 95 <= self.cpu <= 105:
+                self.cpu_at = self.cpu_at or now
+            else:
+                self.cpu_at = None
+
+        if now - self.seen < options['grace']:
+            return []
+
+        checks = {}
+        if options['query_timeout'] and self.server.query_address:
+            checks[f'No query reply for {now - self.query_at:.0f} seconds'] = \
+                now - self.query_at >= options['query_timeout']
+        if options['output_timeout']:
+            checks[f'No output for {now - self.output_at:.0f} seconds'] = \
+                now - self.output_at >= options['output_timeout']
+        if options['cpu_timeout']:
+            checks[f'CPU stuck at {self.cpu:.0f}%'] = \
+                self.cpu_at is not None and now - self.cpu_at >= options['cpu_timeout']
+
+        failed = [reason for reason, hung in checks.items() if hung]
+        if not failed or (options['require'] != 'any' and len(failed) < len(checks)):
+            return []
+        return failed
+
+    def record(self, reasons):
+        '''Write an incident file with the reasons and the last output'''
+        try:
+            lines = [line.decode(errors='replace')
+                     for line in logs.tail(self.server.log_dir, INCIDENT_LINES)]
+        except OSError:
+            lines = []
+
+        if not lines:
+            try:
+                end = self.server.backend.position()
+                lines, _ = self.server.capture(max(end - INCIDENT_LINES, 0))
+            except (AttributeError, IndexError, OSError, ValueError):
+                lines = []
+
+        date = datetime.now().strftime(INCIDENT_DATE)
+        f = Path(Config.state_dir, 'incidents', f'{self.server.session_name}-{date}.log')
+        f.parent.mkdir(parents=True, exist_ok=True)
+        with open(f, 'w') as incident:
+            incident.write(f'Server: {self.server.session_name}\n')
+            incident.write(f'Time: {datetime.now().isoformat(timespec="seconds")}\n')
+            incident.writelines(f'Reason: {reason}\n' for reason in reasons)
+            incident.write(f'Action: {self.options["action"]}\n\n')
+            incident.writelines(f'{line}\n' for line in lines)
+        return f
@@ -0,0 +1,90 @@
+import json
+import os
+from pathlib import Path
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import vdf
+
+
+DETAILS_URL = 'https://api.steampowered.com/ISteamRemoteStorage/GetPublishedFileDetails/v1/'
+
+
+def content_dir(workshop_dir, app_id, item):
+    '''Return directory steamcmd downloads a workshop item to'''
+    return Path(workshop_dir, 'steamapps', 'workshop', 'content', str(app_id), str(item))
+
+
+def installed(workshop_dir, app_id):
+    '''Return dict of installed item ids and the time they were last updated'''
+    f = Path(workshop_dir, 'steamapps', 'workshop', f'appworkshop_{app_id}.acf')
+    try:
+        with open(f, 'r') as manifest:
+            data = vdf.load(manifest)
+    except (OSError, SyntaxError):
+        return {}
+
+    items = data.get('AppWorkshop', {}).get('WorkshopItemsInstalled', {})
+    return {int(item): int(values.get('timeupdated', 0)) for item, values in items.items()
+            if content_dir(workshop_dir, app_id, item).exists()}
+
+
+def details(items, timeout=30):
+    '''Return dict of item ids and the time they were last updated on steam
+
+    All items are looked up in a single request. Items that are missing
+    from the reply, like removed or private items, are left out.
+    '''
+    data = {'itemcount': len(items)}
+    data.update({f'publishedfileids[{i}]': item for i, item in enumerate(items)})
+
+    with urlopen(DETAILS_URL, urlencode(data).encode(), timeout) as response:
+        reply = json.load(response)
+
+    return {int(item['publishedfileid']): int(item.get('time_updated', 0))
+            for item in reply.get('response', {}).get('publishedfiledetails', [])
+            if item.get('result') == 1}
+
+
+def outdated(workshop_dir, app_id, items):
+    '''Return items that are not installed or older than on steam'''
+    local = installed(workshop_dir, app_id)
+    missing = [item for item in items if item not in local]
+    if len(missing) == len(items):
+        return missing
+
+    try:
+        remote = details([item for item in items if item in local])
+    except (OSError, ValueError):
+        # without the details every installed item is downloaded to be sure
+        return list(items)
+    return [item for item in items
+            if item not in local or remote.get(item, 0) > local[item]]
+
+
+def link(workshop_dir, app_id, items, directory):
+    '''Link items from the shared content cache into a server's directory
+
+    Links into the cache for items that are no longer listed are removed,
+    anything else in the directory is left alone.
+    '''
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    cache, listed = content_dir(workshop_dir, app_id, 0).parent, {str(item) for item in items}
+    for dst in directory.iterdir():
+        if (dst.is_symlink() and dst.name not in listed
+                and Path(os.readlink(dst)).parent == cache):
+            dst.unlink()
+
+    linked = []
+    for item in items:
+        src, dst = content_dir(workshop_dir, app_id, item), Path(directory, str(item))
+        if not src.exists():
+            continue
+        if dst.is_symlink() and os.readlink(dst) != str(src):
+            dst.unlink()
+        if not dst.exists():
+            os.symlink(src, dst)
+        linked.append(item)
+    return linked
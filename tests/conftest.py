@@ -1,7 +1,9 @@
+import textwrap
 from pathlib import Path
 from time import sleep
 import pytest
-from scsm.core import App, Server, SteamCMD
+from scsm.config import Config
+from scsm.core import App, Index, Server, SteamCMD
 
 APP_ID = 232370
 APP_NAME = 'hl2dm'
@@ -78,3 +80,32 @@ def steamcmd_removed(steamcmd):
     if steamcmd.installed and steamcmd.exe != 'steamcmd':
         steamcmd.remove()
     return steamcmd
+
+
+@pytest.fixture
+def instance_config(tmp_path, monkeypatch):
+    data_dir, config_dir = Path(tmp_path, 'data'), Path(tmp_path, 'config')
+    Path(data_dir, 'apps').mkdir(parents=True)
+    Path(config_dir, 'apps').mkdir(parents=True)
+    Path(data_dir, 'apps', '4020.yaml').write_text(textwrap.dedent('''\
+        app_id: 4020
+        apps:
+          gmod:
+            fname: "Garry's Mod"
+            platforms:
+              Linux:
+                exec: ./srcds_run
+            servers:
+              gmod:
+                start: ['-game garrysmod']
+                stop: [quit]
+          gmod-ttt:
+            instance_of: gmod
+        '''))
+
+    monkeypatch.setattr(Config, 'data_dir', data_dir)
+    monkeypatch.setattr(Config, 'config_dir', config_dir)
+    monkeypatch.setattr(Config, 'instance_mode', 'symlink')
+    monkeypatch.setattr(Index, 'f', Path(config_dir, 'app_index.yaml'))
+    Index.update()
+    return Path(tmp_path, 'apps')
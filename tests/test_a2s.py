@@ -0,0 +1,67 @@
+import socket
+import struct
+import threading
+from time import sleep
+
+import pytest
+
+from scsm import a2s
+
+
+INFO = (b'\xFF\xFF\xFF\xFFI\x11Test Server\x00dm_lockdown\x00hl2mp\x00Half-Life 2\x00'
+        + struct.pack('<HBBB', 320, 3, 16, 1) + b'dl\x00\x01' + b'1.0\x00')
+PLAYERS = (b'\xFF\xFF\xFF\xFFD\x02'
+           + b'\x00alice\x00' + struct.pack('<lf', 10, 60.0)
+           + b'\x01bob\x00' + struct.pack('<lf', 5, 30.0))
+
+
+@pytest.fixture(params=[0])
+def server(request):
+    '''Local A2S stand-in requiring a challenge and splitting player replies'''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5)
+
+    def serve():
+        while True:
+            try:
+                data, addr = sock.recvfrom(1400)
+            except OSError:
+                return
+
+            if not data.endswith(b'CHAL'):
+                sleep(request.param)
+                sock.sendto(b'\xFF\xFF\xFF\xFFACHAL', addr)
+            elif data.startswith(a2s.A2S_INFO):
+                sock.sendto(INFO, addr)
+            else:
+                for number, part in enumerate([PLAYERS[:20], PLAYERS[20:]]):
+                    sock.sendto(struct.pack('<4slBBH', a2s.SPLIT, 7, 2, number, 1248) + part,
+                                addr)
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield sock.getsockname()
+    sock.close()
+
+
+def test_query(server):
+    info = a2s.query_all([server], players=True)[0]
+    assert info['name'] == 'Test Server'
+    assert info['map'] == 'dm_lockdown'
+    assert (info['players'], info['max_players'], info['bots']) == (3, 16, 1)
+    assert info['vac'] is True
+    assert info['rtt'] >= 0
+    assert [p['name'] for p in info['player_list']] == ['alice', 'bob']
+
+
+def test_query_timeout():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        assert a2s.query_all([sock.getsockname(), sock.getsockname()], 0.1) == [None, None]
+
+
+@pytest.mark.parametrize('server', [0.3], indirect=True)
+def test_query_rtt(server):
+    # a slow challenge is not part of the round trip time
+    info = a2s.query_all([server])[0]
+    assert info['rtt'] < 200
@@ -38,6 +38,20 @@ def test_backup_bad_compression(runner, server_stopped):
     ''')
 
 
+@pytest.mark.skipif(os.geteuid() == 0, reason='root can lower nice')
+def test_backup_bad_nice(runner):
+    result = runner.invoke(cli.backup, ['232370', '--nice', '-5'])
+    assert result.exit_code == 0
+    assert result.output.startswith('[ Error  ] - Unable to set priority')
+
+
+def test_backup_bad_ionice(runner, monkeypatch):
+    monkeypatch.setattr(cli, 'set_priority', lambda nice, ionice: 1)
+    result = runner.invoke(cli.backup, ['232370', '--ionice', 'realtime'])
+    assert result.exit_code == 0
+    assert result.output == '[ Error  ] - Unable to set I/O priority: realtime\n'
+
+
 def test_backup_not_installed(runner, app_removed):
     result = runner.invoke(cli.backup, [str(app_removed.app_id), '--no-compress'])
     assert result.exit_code == 0
@@ -98,6 +112,68 @@ def test_list(runner, app_installed):
     ''')
 
 
+def test_monitor_instance(runner, instance_config, monkeypatch):
+    class Done(Exception):
+        pass
+
+    passes = iter([{'gmod-gmod', 'gmod-ttt-gmod'}, {'gmod-gmod'}])
+    started = []
+
+    def running_sessions():
+        try:
+            return next(passes)
+        except StopIteration:
+            raise Done()
+
+    monkeypatch.setattr(cli.Config, 'app_dir', instance_config)
+    monkeypatch.setattr(cli.Server, 'running_sessions', staticmethod(running_sessions))
+    monkeypatch.setattr(cli, 'start_servers', lambda servers: started.extend(servers))
+    monkeypatch.setattr(cli.metrics, 'record', lambda *args, **kwargs: None)
+    monkeypatch.setattr(cli, 'sleep', lambda seconds: None)
+
+    # the instance shares its server name with the app it is an instance of
+    result = runner.invoke(cli.monitor, ['gmod-ttt', '--restart', '--idle', '0'])
+    assert isinstance(result.exception, Done)
+    assert result.output.count('Stopped') == 1
+    assert [s.session_name for s in started] == ['gmod-ttt-gmod']
+
+
+def test_monitor_hibernate(runner, monkeypatch):
+    class Done(Exception):
+        pass
+
+    passes = iter([{'hl2dm-hl2dm'}, {'hl2dm-hl2dm'}, set(), set()])
+    clock = iter(range(0, 1000, 20))
+    started = []
+
+    def running_sessions():
+        try:
+            return next(passes)
+        except StopIteration:
+            raise Done()
+
+    def hibernate_servers(sessions, running, hibernating, idle_since, idle):
+        # the server goes idle on the second pass and is stopped in it
+        if 'first' in idle_since:
+            sessions['hl2dm-hl2dm']['running'] = False
+            hibernating['hl2dm-hl2dm'] = None
+        idle_since['first'] = True
+
+    monkeypatch.setattr(cli.Server, 'running_sessions', staticmethod(running_sessions))
+    monkeypatch.setattr(cli, 'hibernate_servers', hibernate_servers)
+    monkeypatch.setattr(cli, 'wake_servers', lambda hibernating: None)
+    monkeypatch.setattr(cli, 'watch_servers', lambda *args: None)
+    monkeypatch.setattr(cli, 'start_servers', lambda servers: started.extend(servers))
+    monkeypatch.setattr(cli, 'monotonic', lambda: next(clock))
+    monkeypatch.setattr(cli, 'sleep', lambda seconds: None)
+
+    result = runner.invoke(cli.monitor, ['hl2dm', '--restart', '--idle', '1'])
+    assert isinstance(result.exception, Done)
+    assert result.output.count('Running') == 1
+    assert 'Stopped' not in result.output
+    assert started == []
+
+
 # def test_monitor():
 #     result = runner.invoke(cli.monitor, [app_id], input='$\'\003\'\n')
 #     assert result.exit_code == 0
@@ -130,6 +206,13 @@ def test_restart(runner, server_running):
     ''')
 
 
+def test_restart_rolling(runner, server_running):
+    result = runner.invoke(cli.restart, [server_running.app_name, '--rolling', '--batch', '1'])
+    assert result.exit_code == 0
+    assert '[ Status ] - Wave 1 of' in result.output
+    assert '[ Status ] - Ready in' in result.output
+
+
 def test_restore(runner, server_stopped):
     server_stopped.backup_dir.mkdir(parents=True, exist_ok=True)
     if len(os.listdir(server_stopped.backup_dir)) < 1:
@@ -176,6 +259,12 @@ def test_start(runner, server_stopped):
     ''')
 
 
+def test_start_max_loading(runner, server_stopped):
+    result = runner.invoke(cli.start, [server_stopped.app_name, '--max-loading', '1'])
+    assert result.exit_code == 0
+    assert '[ Status ] - Ready in' in result.output
+
+
 def test_status(runner, server_running):
     result = runner.invoke(cli.status, [server_running.app_name])
     assert result.exit_code == 0
@@ -211,3 +300,31 @@ def test_app_special_names(app, result):
     tmp = cli.app_special_names(app)
     assert type(tmp) is result
     assert isinstance(tmp, result)
+
+
+@pytest.mark.parametrize('status, result', [
+    ('running', ['hl2dm2']), ('stopped', ['hl2dm'])])
+def test_app_special_names_status(status, result, monkeypatch):
+    # the first server is stopped while another one of the app runs
+    monkeypatch.setattr(cli.Index, 'list', lambda directory: iter(['hl2dm']))
+    monkeypatch.setattr(cli.Server, 'running_sessions', staticmethod(lambda: {'hl2dm-hl2dm2'}))
+    assert [*cli.app_special_names((status,))] == result
+
+
+def job(app):
+    if app == 'fail':
+        raise ValueError('Job failed')
+    cli.message('Status', app)
+    return app != 'skip'
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_run_jobs(capsys, jobs):
+    assert cli.run_jobs(job, ['a', 'skip', 'b'], jobs) == ['Done', 'Skip', 'Done']
+    output = capsys.readouterr().out
+    assert output.index('] - a') < output.index('] - b')
+
+
+def test_run_jobs_failed():
+    with pytest.raises(SystemExit):
+        cli.run_jobs(job, ['a', 'fail'], jobs=2)
@@ -1,8 +1,15 @@
 import os
+import libtmux
 import pytest
+import socket
+import tarfile
+import threading
+import types
+from pathlib import Path
 from time import sleep
 
-from scsm.core import Index
+from scsm import core
+from scsm.core import App, Index, Server, SteamCMD, TmuxBackend
 from scsm.config import Config
 
 
@@ -40,6 +47,49 @@ class TestApp():
         app_installed.backup(compression)
         assert len(os.listdir(app_installed.backup_dir)) > len(backups)
 
+    @pytest.mark.parametrize('latest,daily,weekly,monthly,result', [
+        (0, 0, 0, 0, 6),
+        (2, 0, 0, 0, 2),
+        (0, 2, 0, 0, 2),
+        (1, 0, 2, 0, 2),
+        (0, 0, 0, 3, 3),
+    ])
+    def test_retention(self, latest, daily, weekly, monthly, result):
+        backups = ['2023-01-15-120000.tar', '2023-02-01-120000.tar.gz',
+                   '2023-02-20-120000.tar.gz', '2023-03-01-120000.tar.xz',
+                   '2023-03-01-180000.tar', '2023-03-02-120000.tar',
+                   'copy.tar', '2023-03-03-120000.tar.gz.part']
+        keep = App.retention(backups, latest, daily, weekly, monthly)
+        assert len(keep) == result + 2
+        assert '2023-03-02-120000.tar' in keep
+        assert {'copy.tar', '2023-03-03-120000.tar.gz.part'} <= keep
+
+    def test_recompress_backups(self, app, tmp_path):
+        app.backup_dir = tmp_path
+        with tarfile.open(Path(tmp_path, '2023-01-01-120000.tar.gz'), 'w:gz'):
+            pass
+        Path(tmp_path, 'manual-copy.tar.gz').touch()
+        Path(tmp_path, '2023-01-02-120000.tar.gz.part').touch()
+        assert app.recompress_backups('xz') == ['2023-01-01-120000.tar.xz']
+        assert app.backups == ['2023-01-01-120000.tar.xz']
+
+    def test_backup_no_fadvise(self, instance_config, tmp_path, monkeypatch):
+        # like macos and windows, which have neither
+        monkeypatch.delattr(os, 'posix_fadvise')
+        monkeypatch.delattr(os, 'fdatasync')
+        app = App('gmod', instance_config, Path(tmp_path, 'backups'), platform='Linux')
+        Path(app.app_dir, 'bin').mkdir(parents=True)
+        app.backup_dir.mkdir(parents=True)
+        assert app.backup(drop_cache=True).is_file()
+
+    def test_use_depots(self, app):
+        assert app.use_depots is False
+        app.depots = 'auto'
+        assert app.use_depots is True
+        # download_depot can not unlock password protected branches
+        app.beta, app.beta_password = 'staging', 'secret'
+        assert app.use_depots is False
+
     def test_copy_config(self, app):
         app.copy_config()
         assert app.config_is_default is False
@@ -54,6 +104,55 @@ class TestApp():
         assert app_removed.installed is True
 
 
+class TestInstance():
+    def test_servers(self, instance_config):
+        # an instance without servers of its own runs the shared app's
+        assert Index.search('gmod-ttt') == (4020, 'gmod-ttt', None)
+        server = Server('gmod-ttt', instance_config, platform='Linux')
+        assert server.server_names == ['gmod']
+        assert server.session_name == 'gmod-ttt-gmod'
+        assert server.install_dir == Path(instance_config, '4020', 'gmod')
+
+    def test_remove_shared(self, instance_config):
+        base, inst = (App(name, instance_config, platform='Linux')
+                      for name in ('gmod', 'gmod-ttt'))
+        Path(base.app_dir, 'bin').mkdir(parents=True)
+        inst.build_instance()
+
+        with pytest.raises(ValueError):
+            base.remove()
+        assert base.app_dir.exists()
+
+        inst.remove()
+        base.remove()
+        assert not Path(instance_config, '4020').exists()
+
+    def test_update_unmounts(self, instance_config, monkeypatch):
+        base = App('gmod', instance_config, platform='Linux')
+        inst_dir = Path(instance_config, '4020', 'gmod-ttt')
+        mounted, calls = {inst_dir}, []
+
+        def unmount(merged):
+            calls.append('unmount')
+            mounted.discard(merged)
+            return 0
+
+        def app_update(self, app_id, app_dir, *args):
+            # steamcmd only runs with no overlay on top of the install
+            calls.append('update' if not mounted else 'update mounted')
+            Path(app_dir, 'bin').mkdir(parents=True)
+            return 0
+
+        monkeypatch.setattr(core.os.path, 'ismount', lambda path: Path(path) in mounted)
+        monkeypatch.setattr(core.instance, 'unmount', unmount)
+        monkeypatch.setattr(App, 'running', False)
+        monkeypatch.setattr(SteamCMD, 'app_update', app_update)
+
+        assert base.update() == 0
+        assert calls == ['unmount', 'update']
+        assert Path(inst_dir, 'bin').is_dir()
+
+
 class TestIndex():
     def test_list(self, app):
         assert list(Index.list(app.app_dir.parent.parent))
@@ -79,6 +178,33 @@ class TestServer():
     def test_init(self, server):
         assert type(server.server_name) is str
 
+    @pytest.mark.parametrize('protocol,kind', [
+        ('tcp', socket.SOCK_STREAM),
+        ('udp', socket.SOCK_DGRAM),
+    ])
+    def test_port_check(self, protocol, kind):
+        with socket.socket(socket.AF_INET, kind) as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+            if protocol == 'tcp':
+                sock.listen()
+            assert Server.port_check(port, protocol) is True
+        assert Server.port_check(port, 'tcp') is False
+
+    def test_query_check(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+
+            def reply():
+                data, addr = sock.recvfrom(1400)
+                sock.sendto(b'\xFF\xFF\xFF\xFFA1234', addr)
+
+            threading.Thread(target=reply, daemon=True).start()
+            assert Server.query_check(sock.getsockname()[1]) is True
+
+    def test_ready(self, server_running):
+        assert server_running.wait_ready(30) is not None
+
     def test_running(self, server_stopped):
         assert server_stopped.running is False
 
@@ -100,6 +226,62 @@ class TestServer():
         pane_contents = '\n'.join(pane.cmd('capture-pane', '-p').stdout)
         assert 'test' in pane_contents
 
+    def test_send_all(self, server_running):
+        assert Server.send_all([server_running], 'test_all') == [(None, None)]
+        pane = server_running.session.windows[0].panes[0]
+        assert 'test_all' in '\n'.join(pane.cmd('capture-pane', '-p').stdout)
+
+    def test_send_many(self, monkeypatch):
+        server = libtmux.Server()
+        names = ['scsm-test-1', 'scsm-test-missing', 'scsm-test-2']
+        sessions = [server.new_session(name, window_command='cat') for name in names[::2]]
+        try:
+            # the missing session is taken to be running when the chain is built
+            monkeypatch.setattr(TmuxBackend, 'sessions', staticmethod(lambda: set(names)))
+            errors = TmuxBackend.send_many([*names, 'scsm-test-stopped'], 'test_many')
+            assert errors[0] is None and errors[2] is None
+            assert 'scsm-test-missing' in errors[1]
+            assert errors[3] == 'Stopped'
+
+            sleep(0.5)
+            for session in sessions:
+                pane = session.windows[0].panes[0]
+                assert 'test_many' in '\n'.join(pane.cmd('capture-pane', '-p').stdout)
+        finally:
+            for session in sessions:
+                session.kill_session()
+
+    def test_send_capture(self, server_running):
+        lines = server_running.send_capture('echo', timeout=2)
+        assert 'echo' not in lines[:1]
+        assert all(isinstance(line, str) for line in lines)
+
+    @pytest.mark.parametrize('filled', [0, 300])
+    def test_send_capture_history(self, filled):
+        server = libtmux.Server()
+        name = 'scsm-test-history'
+        # history-limit only applies to panes created after it is set
+        session = server.new_session(name, window_command='sleep 100')
+        try:
+            session.set_option('history-limit', 100)
+            session.new_window(window_shell='sh -c \'while read n; do '
+                                            'seq -f "line %g" $n; done\'')
+            session.windows[0].kill_window()
+
+            backend = TmuxBackend(name)
+            if filled:
+                backend.send(str(filled))
+                sleep(0.5)
+
+            # sent like Server.send_capture sends to a tmux console
+            s = types.SimpleNamespace(rcon=None, backend=backend, send=backend.send,
+                                      capture=backend.capture)
+            for count in 16, 40:
+                lines = Server.send_capture(s, str(count), timeout=2, settle=0.3)
+                assert lines == [f'line {i}' for i in range(1, count + 1)]
+        finally:
+            session.kill_session()
+
     def test_stop(self, server_running):
         server_running.stop()
 
@@ -137,6 +319,53 @@ class TestSteamCMD():
         exit_code = steamcmd_installed.app_update(app.app_id, app.app_dir.parent)
         assert exit_code == 0
 
+    def test_depot_download(self, app, steamcmd_installed, tmp_path):
+        data = steamcmd_installed.info(app.app_id)
+        depots = SteamCMD.select_depots(data, 'Linux')
+        manifests = SteamCMD.depot_manifests(data, depots)
+        assert steamcmd_installed.depot_download(app.app_id, manifests, tmp_path) == 0
+        assert not Path(tmp_path, 'steamapps', 'content').exists()
+
+    @pytest.mark.parametrize('platform, arch, languages, result', [
+        ('Linux', '64bit', ['english'], [11, 12, 15]),
+        ('Linux', '32bit', ['english', 'german'], [11, 13, 14, 15]),
+        ('Windows', '64bit', ['english'], [10, 12])])
+    def test_select_depots(self, platform, arch, languages, result):
+        data = {'depots': {
+            '10': {'config': {'oslist': 'windows'}, 'manifests': {'public': '1'}},
+            '11': {'config': {'oslist': 'linux'}, 'manifests': {'public': '2'}},
+            '12': {'config': {'oslist': 'windows,linux', 'osarch': '64'},
+                   'manifests': {'public': {'gid': '3'}}},
+            '13': {'config': {'osarch': '32'}, 'manifests': {'public': '4'}},
+            '14': {'config': {'language': 'german'}, 'manifests': {'public': '5'}},
+            '15': {'config': {'oslist': 'linux'}, 'depotfromapp': '7'},
+            '16': {'config': {'oslist': 'linux'}},
+            'branches': {'public': {'buildid': '100'}}}}
+        assert SteamCMD.select_depots(data, platform, arch, languages) == result
+        assert SteamCMD.depot_manifests(data, [11, 12, 17]) == {11: '2', 12: '3', 17: None}
+        assert SteamCMD.shared_depots(data, [11, 15]) == {15: 7}
+
+    def test_depot_download_shared(self, steamcmd, tmp_path, monkeypatch):
+        commands = []
+
+        def run(args):
+            commands.append(args)
+            for app_id, depot in (10, 11), (7, 15):
+                Path(tmp_path, 'steamapps', 'content', f'app_{app_id}',
+                     f'depot_{depot}').mkdir(parents=True)
+            return 0
+
+        monkeypatch.setattr(steamcmd, 'run', run)
+        exit_code = steamcmd.depot_download(10, {11: '2', 15: None}, tmp_path, 'Windows',
+                                            shared={15: 7})
+        assert exit_code == 0
+        cmd = commands[0]
+        assert cmd[0] == '+@sSteamCmdForcePlatformType windows'
+        assert cmd[1:3] == ['+force_install_dir', tmp_path]
+        assert cmd[7:] == ['+download_depot', '10', '11', '2',
+                           '+download_depot', '7', '15', '+quit']
+        assert not Path(tmp_path, 'steamapps', 'content').exists()
+
     def test_cached_login(self, steamcmd_installed):
         assert steamcmd_installed.cached_login('anonymous') is False
 
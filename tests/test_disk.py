@@ -0,0 +1,63 @@
+import io
+from time import monotonic
+
+from scsm import disk
+
+
+def test_rate_limiter():
+    limiter = disk.RateLimiter(1024 * 1024)
+    start = monotonic()
+    for _ in range(4):
+        limiter.consume(128 * 1024)
+    assert monotonic() - start >= 0.4
+
+
+def test_throttled_reader(tmp_path):
+    f = tmp_path / 'data'
+    f.write_bytes(b'x' * 1024)
+
+    with disk.ThrottledReader(open(f, 'rb'), drop=True) as reader:
+        assert reader.read(1000) == b'x' * 1000
+        assert reader.read() == b'x' * 24
+        assert reader.read() == b''
+    assert reader.offset == 1024
+
+
+def test_throttled_reader_limited():
+    reader = disk.ThrottledReader(io.BytesIO(b'x' * 1024), disk.RateLimiter(2048))
+    start = monotonic()
+    reader.read()
+    assert monotonic() - start >= 0.4
+
+
+def test_disk_usage(tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'a' / 'b' / 'f').write_bytes(b'x' * 10000)
+    cache_f = tmp_path / 'cache' / 'du.json'
+
+    du = disk.DiskUsage(cache_f)
+    size = du.size(tmp_path / 'a')
+    assert size >= 10000
+    du.save()
+
+    du = disk.DiskUsage(cache_f)
+    assert str(tmp_path / 'a' / 'b') in du.cache
+    assert du.size(tmp_path / 'a') == size
+
+    (tmp_path / 'a' / 'b' / 'g').write_bytes(b'x' * 10000)
+    assert du.size(tmp_path / 'a') > size
+
+
+def test_human_size():
+    assert disk.human_size(512) == '512 B'
+    assert disk.human_size(1536) == '1.5 KiB'
+
+
+def test_prewarm(tmp_path):
+    files = []
+    for i in range(4):
+        f = tmp_path / str(i)
+        f.write_bytes(b'x' * 1000)
+        files.append(f)
+
+    assert disk.prewarm(files + [tmp_path / 'missing']) == 4000
@@ -0,0 +1,38 @@
+import socket
+
+from scsm.hibernate import Waker
+
+
+def free_port(kind):
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_woken(waker):
+    waker.event.wait(5)
+    return waker.woken
+
+
+def test_waker_udp():
+    port = free_port(socket.SOCK_DGRAM)
+    waker = Waker([(port, 'udp')], '127.0.0.1')
+    assert not waker.woken
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(b'\xFF\xFF\xFF\xFFTSource Engine Query\x00', ('127.0.0.1', port))
+    assert wait_woken(waker)
+    waker.close()
+
+    # the port is free again for the server
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', port))
+
+
+def test_waker_tcp():
+    port = free_port(socket.SOCK_STREAM)
+    waker = Waker([(port, 'tcp')], '127.0.0.1')
+
+    socket.create_connection(('127.0.0.1', port)).close()
+    assert wait_woken(waker)
+    waker.close()
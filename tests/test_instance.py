@@ -0,0 +1,70 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from scsm.instance import MANIFEST, is_writable, link_farm, resolve_mode
+
+
+@pytest.fixture
+def base(tmp_path):
+    base = Path(tmp_path, 'base')
+    Path(base, 'bin').mkdir(parents=True)
+    Path(base, 'cfg').mkdir()
+    Path(base, 'bin', 'server').write_text('server')
+    Path(base, 'cfg', 'server.cfg').write_text('hostname base')
+    Path(base, 'map.bsp').write_text('map')
+    return base
+
+
+@pytest.mark.parametrize('path, writable, result', [
+    ('cfg/server.cfg', ['cfg'], True), ('cfg', ['cfg/'], True),
+    ('bin/server', ['cfg'], False), ('game/cfg/a.cfg', ['*/cfg'], True),
+    ('save.dat', ['*.dat'], True), ('bin/server', [], False)])
+def test_is_writable(path, writable, result):
+    assert is_writable(path, writable) is result
+
+
+def test_resolve_mode():
+    assert resolve_mode('symlink') == 'symlink'
+    assert resolve_mode('auto') in ('overlay', 'symlink')
+    with pytest.raises(ValueError):
+        resolve_mode('copy')
+
+
+@pytest.mark.parametrize('hardlink', [False, True])
+def test_link_farm(base, tmp_path, hardlink):
+    inst = Path(tmp_path, 'instance')
+    assert link_farm(base, inst, ['cfg'], hardlink) == 2
+
+    assert Path(inst, 'bin').is_dir() and not Path(inst, 'bin').is_symlink()
+    assert Path(inst, 'bin', 'server').read_text() == 'server'
+    assert Path(inst, 'bin', 'server').is_symlink() is not hardlink
+    assert os.path.samefile(Path(inst, 'map.bsp'), Path(base, 'map.bsp'))
+
+    # writable files are copies the server can change without touching the base
+    Path(inst, 'cfg', 'server.cfg').write_text('hostname instance')
+    assert Path(base, 'cfg', 'server.cfg').read_text() == 'hostname base'
+
+    # a rebuild follows the base and keeps the instance's own files
+    Path(base, 'map.bsp').unlink()
+    Path(base, 'new.bsp').write_text('new')
+    Path(inst, 'bin', 'local.txt').write_text('local')
+    link_farm(base, inst, ['cfg'], hardlink)
+
+    assert not Path(inst, 'map.bsp').exists()
+    assert Path(inst, 'new.bsp').read_text() == 'new'
+    assert Path(inst, 'bin', 'local.txt').read_text() == 'local'
+    assert Path(inst, 'cfg', 'server.cfg').read_text() == 'hostname instance'
+    assert Path(inst, MANIFEST).read_text().split() == ['bin/server', 'new.bsp']
+
+
+def test_link_farm_replaced_file(base, tmp_path):
+    inst = Path(tmp_path, 'instance')
+    link_farm(base, inst, hardlink=True)
+
+    # updates replace files instead of writing them in place
+    Path(base, 'map.bsp').unlink()
+    Path(base, 'map.bsp').write_text('updated')
+    link_farm(base, inst, hardlink=True)
+    assert Path(inst, 'map.bsp').read_text() == 'updated'
@@ -0,0 +1,53 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from scsm.limits import current, format_cpus, parse_cpus, parse_size
+
+
+@pytest.mark.parametrize('cpus, expected', [
+    (2, {2}), ([0, 1], {0, 1}), ('0-3', {0, 1, 2, 3}), ('0,2-3', {0, 2, 3}), ('5', {5})])
+def test_parse_cpus(cpus, expected):
+    assert parse_cpus(cpus) == expected
+
+
+def test_format_cpus():
+    assert format_cpus({0, 1, 2, 3, 6, 8, 9}) == '0-3,6,8-9'
+    assert format_cpus(parse_cpus('1,3-5')) == '1,3-5'
+
+
+@pytest.mark.parametrize('size, expected', [
+    (1024, 1024), ('512M', 512 * 1024 ** 2), ('1.5g', 3 * 1024 ** 3 // 2), ('max', 'max')])
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+def test_launcher(tmp_path):
+    state_f = tmp_path / 'app-server.json'
+    limits = {'nice': 3, 'rlimits': {'nofile': 512, 'core': [0, 'unlimited']}}
+    cmd = (f'exec {sys.executable} -c "import os, resource; '
+           'print(os.getpriority(os.PRIO_PROCESS, 0), os.getpid(), '
+           'resource.getrlimit(resource.RLIMIT_NOFILE)[0])"')
+
+    result = subprocess.run([sys.executable, '-m', 'scsm.limits', str(state_f),
+                             json.dumps(limits), cmd],
+                            capture_output=True, text=True, check=True,
+                            env={**os.environ, 'PYTHONPATH': os.getcwd()})
+    nice, pid, nofile = result.stdout.split()
+    assert int(nice) == os.getpriority(os.PRIO_PROCESS, 0) + 3
+    assert int(nofile) == 512
+
+    # the launcher execs the command so the recorded pid is the server's
+    state = json.loads(state_f.read_text())
+    assert state['pid'] == int(pid)
+    assert state['limits'] == limits
+    assert state['errors'] == []
+
+
+def test_current():
+    given = current(os.getpid(), ['nofile'])
+    soft, hard = given['rlimits']['nofile']
+    assert soft == 'unlimited' or soft > 0
@@ -0,0 +1,90 @@
+import gzip
+import re
+import threading
+from datetime import datetime
+from time import sleep
+
+from scsm.logs import CURRENT, LOG_DATE, LogWriter, follow, parse_since, read, segments, tail
+
+
+def test_log_writer(tmp_path):
+    writer = LogWriter(tmp_path, max_size=1 / 1024)
+    writer.write(b'x' * 512)
+    assert segments(tmp_path) == []
+
+    writer.write(b'x' * 512)
+    writer.close()
+    files = segments(tmp_path)
+    assert [f.suffix for f in files] == ['.gz']
+    assert gzip.open(files[0]).read() == b'x' * 1024
+    assert (tmp_path / CURRENT).stat().st_size == 0
+
+
+def test_log_writer_restart(tmp_path):
+    (tmp_path / CURRENT).write_bytes(b'previous boot\n')
+    writer = LogWriter(tmp_path, compression='')
+    writer.close()
+    assert [f.read_bytes() for f in segments(tmp_path)] == [b'previous boot\n']
+
+
+def test_log_writer_prune(tmp_path):
+    writer = LogWriter(tmp_path, max_size=1 / 1024, max_total=2 / 1024, compression='')
+    for i in range(4):
+        writer.write(bytes([i]) * 1024)
+    writer.close()
+    assert [f.read_bytes()[:1] for f in segments(tmp_path)] == [b'\x02', b'\x03']
+
+
+def test_parse_since():
+    assert abs(parse_since('2h') - (datetime.now().timestamp() - 7200)) < 5
+    assert parse_since('2024-01-02 03:04:05') == datetime(2024, 1, 2, 3, 4, 5).timestamp()
+
+
+def test_tail(tmp_path):
+    writer = LogWriter(tmp_path, max_size=1 / 1024)
+    for i in range(200):
+        writer.write(f'line {i}\r\n'.encode())
+    writer.close()
+
+    assert segments(tmp_path)
+    assert tail(tmp_path, 3) == [b'line 197', b'line 198', b'line 199']
+    assert len(tail(tmp_path, 150)) == 150
+    assert tail(tmp_path, 2, re.compile(rb'line 1\d$')) == [b'line 18', b'line 19']
+
+
+def test_read_since(tmp_path):
+    old = datetime(2024, 1, 1).timestamp()
+    name = datetime(2024, 1, 2).strftime(LOG_DATE)
+    with gzip.open(tmp_path / f'{name}.log.gz', 'wb') as f:
+        f.write(b'skipped\nalso skipped\n')
+    (tmp_path / f'{name}.idx').write_text(f'{int(old)} 0\n')
+
+    (tmp_path / CURRENT).write_bytes(b'before\nafter\nlast\n')
+    (tmp_path / 'current.idx').write_text(f'{int(old)} 0\n{int(old) + 3600} 7\n')
+
+    assert [*read(tmp_path)] == [b'skipped', b'also skipped', b'before', b'after', b'last']
+    assert [*read(tmp_path, old + 1800)] == [b'after', b'last']
+    assert [*read(tmp_path, old + 1800, re.compile(b'^l'))] == [b'last']
+
+
+def test_follow(tmp_path):
+    writer = LogWriter(tmp_path, max_size=1 / 1024)
+    writer.write(b'old\n')
+    found = []
+
+    def reader():
+        for line in follow(tmp_path, interval=0.01):
+            found.append(line)
+            if len(found) == 3:
+                break
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    sleep(0.1)
+    writer.write(b'new\n')
+    writer.write(b'x' * 1024 + b'\n')
+    sleep(0.1)
+    writer.write(b'rotated\n')
+    thread.join(5)
+    writer.close()
+    assert found == [b'new', b'x' * 1024, b'rotated']
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+from scsm import metrics
+from scsm.config import Config
+
+
+@pytest.fixture
+def state_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'state_dir', tmp_path)
+    return tmp_path
+
+
+def test_record(state_dir):
+    metrics.record('scsm_monitor_restarts_total', 1, increment=True, app='a', server='b')
+    metrics.record('scsm_monitor_restarts_total', 1, increment=True, app='a', server='b')
+    metrics.record('scsm_backup_size_bytes', 100, app='a')
+    metrics.record('scsm_backup_size_bytes', 200, app='a')
+
+    assert sorted(metrics.collect()) == [
+        ('scsm_backup_size_bytes', {'app': 'a'}, 200),
+        ('scsm_monitor_restarts_total', {'app': 'a', 'server': 'b'}, 2),
+    ]
+
+
+def test_collect_servers(state_dir):
+    metrics.record_start('a-up', 'a', 'up', os.getpid())
+    metrics.record_start('a-down', 'a', 'down', os.getpid())
+    # pid reused by another process
+    (state_dir / 'pids' / 'a-down.json').write_text(
+        f'{{"app": "a", "server": "down", "pid": {os.getpid()}, "start_time": 0}}')
+
+    samples = {(name, labels['server']): value for name, labels, value in metrics.collect()}
+    assert samples[('scsm_server_up', 'up')] == 1
+    assert samples[('scsm_server_up', 'down')] == 0
+    assert samples[('scsm_server_memory_bytes', 'up')] > 0
+    assert ('scsm_server_memory_bytes', 'down') not in samples
+
+
+def test_render():
+    text = metrics.render([('scsm_server_up', {'app': 'a"b', 'server': 'c'}, 1)])
+    assert text == ('# HELP scsm_server_up Whether the server process is running\n'
+                    '# TYPE scsm_server_up gauge\n'
+                    'scsm_server_up{app="a\\"b",server="c"} 1\n')
@@ -0,0 +1,47 @@
+import os
+import subprocess
+
+import pytest
+
+from scsm import proc
+
+
+@pytest.mark.parametrize('children_files', [True, False])
+def test_children(monkeypatch, children_files):
+    monkeypatch.setattr(proc, 'CHILDREN_FILES', proc.CHILDREN_FILES and children_files)
+    child = subprocess.Popen(['sleep', '10'])
+    try:
+        pids = proc.children(os.getpid())
+        assert pids[0] == os.getpid()
+        assert child.pid in pids
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_open_files(tmp_path):
+    f = tmp_path / 'map.bsp'
+    f.write_bytes(b'x')
+
+    with open(f, 'rb'):
+        assert str(f) in proc.open_files(os.getpid())
+
+
+def test_usage():
+    child = subprocess.Popen(['sleep', '10'])
+    try:
+        usage = proc.usage(os.getpid())
+        assert usage['processes'] >= 2
+        assert usage['threads'] >= 2
+        assert usage['rss'] > 0
+        assert usage['files'] > 0
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_rates():
+    first = {'time': 10, 'cpu': 1.0, 'read_bytes': 0, 'write_bytes': 100}
+    last = {'time': 12, 'cpu': 2.0, 'read_bytes': 4096, 'write_bytes': 100}
+    assert proc.rates(first, last) == {'cpu_percent': 50.0, 'read_rate': 2048.0,
+                                       'write_rate': 0.0}
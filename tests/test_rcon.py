@@ -0,0 +1,117 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+from scsm import rcon
+
+
+def packet(request_id, kind, body):
+    data = struct.pack('<ii', request_id, kind) + body.encode() + b'\x00\x00'
+    return struct.pack('<i', len(data)) + data
+
+
+@pytest.fixture
+def received():
+    return []
+
+
+@pytest.fixture
+def server(received):
+    '''Local RCON stand-in with password secret, kick closes after replying'''
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+
+    def handle(conn):
+        with conn:
+            f = conn.makefile('rb')
+            kicked = False
+            while True:
+                try:
+                    header = f.read(4)
+                except OSError:
+                    return
+                if not header:
+                    return
+                data = f.read(struct.unpack('<i', header)[0])
+                request_id, kind = struct.unpack_from('<ii', data)
+                body = data[8:-2].decode()
+
+                if kind == rcon.SERVERDATA_AUTH:
+                    conn.sendall(packet(request_id, rcon.SERVERDATA_RESPONSE_VALUE, ''))
+                    request_id = request_id if body == 'secret' else -1
+                    conn.sendall(packet(request_id, rcon.SERVERDATA_AUTH_RESPONSE, ''))
+                elif kind == rcon.SERVERDATA_EXECCOMMAND:
+                    received.append(body)
+                    if body == 'quit':
+                        return
+                    kicked = body == 'kick'
+                    # long output is split over several packets
+                    conn.sendall(packet(request_id, 0, f'{body} part 1\n'))
+                    conn.sendall(packet(request_id, 0, f'{body} part 2\n'))
+                else:
+                    conn.sendall(packet(request_id, 0, ''))
+                    conn.sendall(packet(request_id, 0, '\x01'))
+                    if kicked:
+                        return
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield listener
+    listener.close()
+
+
+def test_command(server):
+    client = rcon.RCON(*server.getsockname(), 'secret')
+    assert client.command('status') == 'status part 1\nstatus part 2\n'
+    assert client.command('users') == 'users part 1\nusers part 2\n'
+    client.close()
+
+
+def test_auth_failed(server):
+    with pytest.raises(rcon.RCONError):
+        rcon.RCON(*server.getsockname(), 'wrong').command('status')
+
+
+def test_quit(server):
+    client = rcon.RCON(*server.getsockname(), 'secret')
+    assert client.command('quit', expect_close=True) == ''
+
+
+def test_reconnect(server):
+    client = rcon.connection(*server.getsockname(), 'secret')
+    assert rcon.connection(*server.getsockname(), 'secret') is client
+
+    client.command('status')
+    # a stale pooled connection is replaced
+    client.sock.close()
+    assert client.command('status') == 'status part 1\nstatus part 2\n'
+
+
+def test_quit_stale(server, received):
+    client = rcon.RCON(*server.getsockname(), 'secret')
+    client.command('kick')
+
+    # a pooled connection closing does not acknowledge quit, it is sent again
+    assert client.command('quit', expect_close=True) == ''
+    assert received == ['kick', 'quit']
+
+
+def test_quit_stopped(server, received):
+    client = rcon.RCON(*server.getsockname(), 'secret')
+    client.command('kick')
+
+    # the server is gone, left to the caller's fallback
+    server.shutdown(socket.SHUT_RDWR)
+    with pytest.raises(ConnectionError):
+        client.command('quit', expect_close=True)
+    assert received == ['kick']
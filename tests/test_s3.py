@@ -0,0 +1,52 @@
+import os
+import tarfile
+
+import pytest
+
+from scsm.s3 import MIN_PART_SIZE, S3Storage
+
+moto = pytest.importorskip('moto')
+
+
+@pytest.fixture
+def storage():
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with moto.mock_aws():
+        storage = S3Storage('scsm', 'backups', region='us-east-1', workers=2, part_size=5)
+        storage.client.create_bucket(Bucket='scsm')
+        yield storage
+
+
+def test_multipart_round_trip(storage):
+    data = os.urandom(MIN_PART_SIZE * 2 + 1024)
+
+    with storage.open('232370/hl2dm/2023-01-01-120000.tar', 'wb') as f:
+        for i in range(0, len(data), 100000):
+            f.write(data[i:i + 100000])
+
+    assert storage.list('232370/hl2dm') == ['2023-01-01-120000.tar']
+    with storage.open('232370/hl2dm/2023-01-01-120000.tar') as f:
+        assert f.read() == data
+
+
+def test_abort(storage):
+    with pytest.raises(ValueError):
+        with storage.open('232370/hl2dm/2023-01-01-120000.tar', 'wb') as f:
+            f.write(b'data')
+            raise ValueError()
+
+    assert storage.list('232370/hl2dm') == []
+
+
+def test_tar_stream(storage, tmp_path):
+    (tmp_path / 'server.cfg').write_text('hostname test')
+
+    with storage.open('232370/hl2dm/backup.tar.gz', 'wb') as f:
+        with tarfile.open(fileobj=f, mode='w|gz') as tar:
+            tar.add(tmp_path / 'server.cfg', arcname='hl2dm/server.cfg')
+
+    with storage.open('232370/hl2dm/backup.tar.gz') as f:
+        with tarfile.open(fileobj=f, mode='r|*') as tar:
+            assert [m.name for m in tar] == ['hl2dm/server.cfg']
@@ -0,0 +1,63 @@
+import json
+import os
+from time import sleep
+
+from scsm.supervisor import SupervisorBackend
+
+
+def wait_for(func, timeout=5):
+    for _ in range(int(timeout / 0.05)):
+        if func():
+            return True
+        sleep(0.05)
+    return False
+
+
+def test_supervisor(tmp_path):
+    backend = SupervisorBackend('app-test', tmp_path)
+    assert not backend.running
+
+    backend.start('echo ready; while read line; do echo "got $line"; done', tmp_path)
+    try:
+        assert backend.running
+        assert SupervisorBackend.sessions(tmp_path) == {'app-test'}
+        assert wait_for(lambda: backend.capture()[0] == ['ready'])
+
+        assert backend.position() == 1
+        backend.send('status')
+        assert wait_for(lambda: 'got status' in backend.capture(1)[0])
+        assert backend.capture(1)[1] == 3
+        assert backend.position() == 3
+
+        backend.send('c-c')
+        assert wait_for(lambda: not backend.running)
+        assert SupervisorBackend.sessions(tmp_path) == set()
+    finally:
+        backend.kill()
+
+
+def test_supervisor_kill(tmp_path):
+    backend = SupervisorBackend('app-test', tmp_path)
+    backend.start('sleep 100', tmp_path)
+    assert backend.running
+
+    backend.kill()
+    assert wait_for(lambda: not backend.running)
+
+
+def test_supervisor_stale_pid(tmp_path):
+    # the pid of a server that exited reused by another process
+    backend = SupervisorBackend('app-test', tmp_path)
+    backend.pid_f.write_text(json.dumps({'pid': os.getpid(), 'start_time': 1}))
+    assert backend.pid is None
+    assert not backend.running
+    assert SupervisorBackend.sessions(tmp_path) == set()
+
+
+def test_supervisor_bad_cwd(tmp_path):
+    backend = SupervisorBackend('app-test', tmp_path)
+    backend.start('sleep 100', tmp_path / 'missing')
+    try:
+        assert wait_for(lambda: not backend.running and not backend.sock_f.exists())
+    finally:
+        backend.kill()
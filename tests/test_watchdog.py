@@ -0,0 +1,86 @@
+from collections import deque
+from time import sleep
+
+import pytest
+
+from scsm.config import Config
+from scsm.watchdog import Watchdog
+
+
+class Backend():
+    def __init__(self):
+        self.lines = ['starting', 'tick']
+
+    def position(self):
+        return len(self.lines)
+
+
+class Server():
+    '''Stand-in with only what the watchdog uses'''
+    def __init__(self, tmp_path, **options):
+        self.session_name = 'app-server'
+        self.log_dir = tmp_path / 'logs'
+        self.watchdog_options = {'grace': 0, **options}
+        self.query_address = ('127.0.0.1', 27015)
+        self.backend = Backend()
+        self.samples = deque(maxlen=2)
+
+    def capture(self, start=0):
+        return self.backend.lines[start:], len(self.backend.lines)
+
+    def sample(self):
+        self.samples.append({})
+        return {'cpu_percent': 0.0}
+
+
+@pytest.fixture(autouse=True)
+def state_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'state_dir', tmp_path)
+    monkeypatch.setattr(Config, 'log_enabled', False)
+
+
+def test_output_timeout(tmp_path):
+    server = Server(tmp_path, output_timeout=0.1)
+    watchdog = Watchdog(server)
+    assert watchdog.check() == []
+
+    sleep(0.15)
+    server.backend.lines.append('tick')
+    assert watchdog.check() == []
+
+    sleep(0.15)
+    assert watchdog.check() == ['No output for 0 seconds']
+
+
+def test_require_all(tmp_path):
+    watchdog = Watchdog(Server(tmp_path, output_timeout=0.1, query_timeout=0.1))
+    sleep(0.15)
+    assert watchdog.check({'players': 0}) == []
+    sleep(0.15)
+    assert len(watchdog.check()) == 2
+
+    watchdog.options['require'] = 'any'
+    assert len(watchdog.check({'players': 0})) == 1
+
+
+def test_cpu_timeout(tmp_path):
+    watchdog = Watchdog(Server(tmp_path, cpu_timeout=0.1))
+    watchdog.check()
+    watchdog.check()
+    sleep(0.15)
+    assert watchdog.check() == ['CPU stuck at 0%']
+
+
+def test_grace(tmp_path):
+    watchdog = Watchdog(Server(tmp_path, output_timeout=0.01, grace=60))
+    sleep(0.05)
+    assert watchdog.check() == []
+
+
+def test_record(tmp_path):
+    watchdog = Watchdog(Server(tmp_path))
+    f = watchdog.record(['No output for 300 seconds'])
+    text = f.read_text()
+    assert f.parent == tmp_path / 'incidents'
+    assert 'Reason: No output for 300 seconds' in text
+    assert text.endswith('starting\ntick\n')
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pytest
+import vdf
+
+from scsm import workshop
+
+
+APP_ID = 4000
+
+
+@pytest.fixture
+def workshop_dir(tmp_path):
+    items = {'101': {'size': '10', 'timeupdated': '1000', 'manifest': '1'},
+             '102': {'size': '20', 'timeupdated': '2000', 'manifest': '2'},
+             '103': {'size': '30', 'timeupdated': '3000', 'manifest': '3'}}
+    manifest = {'AppWorkshop': {'appid': str(APP_ID), 'WorkshopItemsInstalled': items}}
+
+    f = Path(tmp_path, 'steamapps', 'workshop', f'appworkshop_{APP_ID}.acf')
+    f.parent.mkdir(parents=True)
+    f.write_text(vdf.dumps(manifest))
+
+    # 103 is in the manifest but its content was removed
+    for item in 101, 102:
+        workshop.content_dir(tmp_path, APP_ID, item).mkdir(parents=True)
+    return tmp_path
+
+
+def test_installed(workshop_dir):
+    assert workshop.installed(workshop_dir, APP_ID) == {101: 1000, 102: 2000}
+    assert workshop.installed(workshop_dir, 730) == {}
+
+
+def test_outdated(workshop_dir, monkeypatch):
+    monkeypatch.setattr(workshop, 'details', lambda items: {101: 1000, 102: 2500})
+    assert workshop.outdated(workshop_dir, APP_ID, [101, 102, 103, 104]) == [102, 103, 104]
+
+    # nothing is looked up when no item is installed
+    assert workshop.outdated(workshop_dir, 730, [101, 102]) == [101, 102]
+
+
+def test_outdated_offline(workshop_dir, monkeypatch):
+    def details(items):
+        raise OSError('Network is unreachable')
+
+    monkeypatch.setattr(workshop, 'details', details)
+    assert workshop.outdated(workshop_dir, APP_ID, [101, 102]) == [101, 102]
+
+
+def test_link(workshop_dir, tmp_path):
+    directory = Path(tmp_path, 'server', 'workshop')
+    assert workshop.link(workshop_dir, APP_ID, [101, 102, 104], directory) == [101, 102]
+    assert Path(directory, '101').resolve() == workshop.content_dir(workshop_dir, APP_ID, 101)
+    assert not Path(directory, '104').exists()
+
+    # linking again leaves existing links alone
+    assert workshop.link(workshop_dir, APP_ID, [101], directory) == [101]
+
+
+def test_link_removed(workshop_dir, tmp_path):
+    directory = Path(tmp_path, 'server', 'workshop')
+    workshop.link(workshop_dir, APP_ID, [101, 102], directory)
+    Path(directory, 'local').mkdir()
+    Path(directory, 'other').symlink_to(Path(tmp_path, 'other'))
+
+    # only links into the cache for items dropped from the list are removed
+    assert workshop.link(workshop_dir, APP_ID, [102], directory) == [102]
+    assert sorted(p.name for p in directory.iterdir()) == ['102', 'local', 'other']